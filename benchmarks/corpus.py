@@ -0,0 +1,18 @@
+import numpy as np
+
+
+def clustered_vectors(n: int, width: int, queries: int = 0, centres: int = 1000, spread: float = .6,
+                      seed: int = 0) -> tuple:
+    """<n> corpus and <queries> query vectors clustered, as real listings are, around <centres> random centres,
+    each scattered by <spread>."""
+    generator = np.random.RandomState(seed)
+    centres = generator.randn(centres, width)
+    vectors = (centres[generator.randint(0, len(centres), n)] + spread * generator.randn(n, width)).astype(np.float32)
+    query = (centres[generator.randint(0, len(centres), queries)] +
+             spread * generator.randn(queries, width)).astype(np.float32)
+    return vectors, query
+
+
+def recall(found: list, exact: list) -> float:
+    """Mean fraction of each exact result list that was found."""
+    return float(np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(found, exact)]))
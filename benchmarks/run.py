@@ -0,0 +1,445 @@
+"""Offline benchmarks for each stage of a Job-finder run, and for a whole run.
+
+Run from the repository root:
+    $ python -m benchmarks.run --output bench_results.json
+
+Scraping runs against a local Indeed stand-in server and email goes to a local aiosmtpd server, so nothing leaves
+the machine. Results are written as JSON for comparison between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import smtplib
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from contextlib import contextmanager
+
+# Keep the listing cache and vector store of benchmark runs away from the user's.
+os.environ.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='job_finder_bench_'))
+
+from job_finder import job_finder  # noqa: E402
+from job_finder.ann import STORAGE, IVFIndex  # noqa: E402
+from job_finder.dedup import normalize  # noqa: E402
+from job_finder.matching import cosine_scores, top_k  # noqa: E402
+from job_finder.quantize import QUANTIZERS, quantize  # noqa: E402
+from job_finder.cache import ListingCache, ListingFilter  # noqa: E402
+from job_finder.mail import MailQueue, SMTPPool, smtp_connector  # noqa: E402
+from job_finder.parsing import BACKENDS, parse_fields, parse_links  # noqa: E402
+from job_finder.metrics import metrics  # noqa: E402
+from job_finder.shortening import StubProvider, UrlShortener  # noqa: E402
+from job_finder.sparse import SparseRanker  # noqa: E402
+from job_finder.throttle import RequestScheduler  # noqa: E402
+from job_finder.vectors import vectorize  # noqa: E402
+
+from .corpus import clustered_vectors, recall  # noqa: E402
+from .server import FIXTURES, TITLES, IndeedStandIn, detail_page, results_page  # noqa: E402
+
+DEFAULT_SIZES = '10,100,1000,10000,100000'
+RESUME = FIXTURES[5]  # The data science resume in examples.py.
+
+
+def best_time(fn, repeat: int = 3) -> float:
+    """Fastest of <repeat> calls to <fn>, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def synthetic_corpus(n: int, width: int, duplicates: float = .1, seed: int = 0) -> tuple:
+    """<n> listing tuples and a matching float32 vector matrix, with a fraction of near duplicate rows."""
+    generator = np.random.RandomState(seed)
+    vectors = generator.randn(n, width).astype(np.float32)
+    copies = generator.rand(n) < duplicates
+    sources = generator.randint(0, max(n, 1), size=n)
+    vectors[copies] = vectors[sources[copies]] + 1e-4 * generator.randn(int(copies.sum()), width)
+    words = ' '.join(FIXTURES).split()
+    texts = [' '.join(generator.choice(words, 120)) for _ in range(n)]
+    for i in np.flatnonzero(copies):
+        texts[i] = texts[sources[i]]
+    listings = [(f'http://www.indeed.com/rc/clk?jk={i:08d}', texts[i], f'Job {i}') for i in range(n)]
+    return listings, vectors
+
+
+def stub_shortener(delay: float = 0.) -> UrlShortener:
+    """A url shortener that never leaves the machine, with a fresh cache."""
+    descriptor, path = tempfile.mkstemp(suffix='.sqlite3', dir=os.environ['CACHE_DIR'])
+    os.close(descriptor)
+    return UrlShortener(StubProvider(delay), path)
+
+
+def offline_finder() -> job_finder.JobFinder:
+    """A JobFinder for timing single stages: it has no model and uses a stub shortener."""
+    finder = job_finder.JobFinder(1, 10, RESUME, 'bench@localhost', nlp=object(),
+                                  listing_cache=ListingCache(os.path.join(os.environ['CACHE_DIR'], 'bench.sqlite3')))
+    finder._url_shortener = stub_shortener()
+    return finder
+
+
+def bench_scrape(stand_in: IndeedStandIn, pages: int, rate: float, parse_processes: int = 0) -> dict:
+    """Time scraping <pages> results pages, sending at most <rate> requests a second."""
+    scraper = job_finder.IndeedScraper(pages, 0, 'Seattle', 'WA', 'data scientist', base_url=stand_in.url,
+                                       parse_processes=parse_processes)
+    scraper.scheduler = RequestScheduler(scraper.http, rate=rate, backoff=.05)
+    counters = dict(metrics.counters)
+    start = time.perf_counter()
+    descriptions = scraper.get_descriptions()
+    seconds = time.perf_counter() - start
+    return {'pages': pages, 'listings': len(descriptions), 'parse_processes': scraper.parse_processes,
+            'seconds': seconds, 'pages_per_sec': pages / seconds, 'listings_per_sec': len(descriptions) / seconds,
+            'skipped_pages': scraper.skipped_pages, 'skipped_descriptions': scraper.skipped_descriptions,
+            **{name: metrics.counters.get(name, 0) - counters.get(name, 0)
+               for name in ('fetch_retries', 'throttled_responses')}}
+
+
+def bench_throttled_scrape(pages: int, per_page: int, limit: float, rate: float) -> dict:
+    """Scrape a stand-in allowing <limit> requests a second, starting from <rate> a second."""
+    with IndeedStandIn(per_page=per_page, rate_limit=limit) as stand_in:
+        result = bench_scrape(stand_in, pages, rate)
+        result.update(server_limit=limit, start_rate=rate, server_requests=stand_in.requests,
+                      server_throttled=stand_in.throttled)
+    return result
+
+
+def bench_parse(repeat: int) -> dict:
+    results, detail = results_page(0, 15), detail_page('bench')
+    timings = {}
+    for backend in BACKENDS:
+        timings[backend] = {
+            'results_us_per_page': best_time(lambda: parse_links(results, backend), repeat) * 1e6,
+            'description_us_per_page': best_time(lambda: parse_fields(detail, backend), repeat) * 1e6,
+        }
+    return timings
+
+
+def bench_vectorize(nlp, n: int) -> dict:
+    texts = [FIXTURES[i % len(FIXTURES)] for i in range(n)]
+    seconds = best_time(lambda: vectorize(nlp, texts, progress=False), 1)
+    return {'docs': n, 'seconds': seconds, 'docs_per_sec': n / seconds}
+
+
+def rank_with(engine: str, nlp, texts: list, k: int) -> list:
+    """Indices of the <k> <texts> best matching RESUME by one ranking engine, as JobFinder ranks them."""
+    if engine == 'spacy':
+        scores = cosine_scores(vectorize(nlp, [RESUME], progress=False), vectorize(nlp, texts, progress=False))
+        return top_k(scores, k)[0].tolist()
+    ranker = SparseRanker('bm25' if engine == 'bm25' else 'tfidf')
+    scores = ranker.score([RESUME], ranker.fit(texts))
+    if engine != 'hybrid':
+        return top_k(scores, k)[0].tolist()
+    candidates = top_k(scores, max(job_finder.HYBRID_CANDIDATES, k))[0]
+    scores = cosine_scores(vectorize(nlp, [RESUME], progress=False),
+                           vectorize(nlp, [texts[i] for i in candidates], progress=False))
+    return candidates[top_k(scores, k)[0]].tolist()
+
+
+def bench_engines(nlp, n: int, k: int) -> dict:
+    """Ranking throughput of each engine on <n> fixture texts, and how many of the <k> fixture paragraphs it ranks
+    best for the resume are among Spacy's best <k>, or TF-IDF's without a model.
+    """
+    texts = [FIXTURES[i % len(FIXTURES)] for i in range(n)]
+    paragraphs = [paragraph for fixture in FIXTURES if fixture is not RESUME
+                  for paragraph in fixture.split('\n\n') if paragraph.strip()]
+    engines = ['tfidf', 'bm25'] + (['spacy', 'hybrid'] if nlp is not None else [])
+    best = {engine: rank_with(engine, nlp, paragraphs, k) for engine in engines}
+    reference = 'spacy' if nlp is not None else 'tfidf'
+    report = {'docs': n, 'paragraphs': len(paragraphs), 'k': k, 'overlap_with': reference}
+    for engine in engines:
+        seconds = best_time(lambda: rank_with(engine, nlp, texts, k), 1)
+        report[engine] = {'seconds': seconds, 'docs_per_sec': n / seconds,
+                          'overlap': recall([best[engine]], [best[reference]])}
+    return report
+
+
+def bench_rank(sizes: list, width: int, num_jobs: int) -> list:
+    timings = []
+    for n in sizes:
+        listings, vectors = synthetic_corpus(n, width)
+        finder = offline_finder()
+        finder.num_jobs = num_jobs * 2
+        finder.descriptions, finder.vectors = listings, vectors
+        query = np.random.RandomState(1).randn(1, width).astype(np.float32)
+        finder.get_document_vectors = lambda documents: query
+
+        def rank() -> None:
+            finder.jobs = []
+            finder.get_best_jobs()
+        timings.append({'n': n, 'get_best_jobs_seconds': best_time(rank)})
+    return timings
+
+
+def bench_dedup(sizes: list, width: int) -> list:
+    timings = []
+    for n in sizes:
+        listings, vectors = synthetic_corpus(n, width)
+        finder = offline_finder()
+        finder.num_jobs = 2 * n  # Keep every unique row so the whole set is compared.
+        finder.vectors, finder.neighbors = vectors, list(range(n))
+
+        def dedup() -> None:
+            finder.jobs = listings
+            finder.remove_duplicates()
+        timings.append({'n': n, 'remove_duplicates_seconds': best_time(dedup, 1), 'kept': len(finder.jobs)})
+    return timings
+
+
+def bench_ann(sizes: list, width: int, k: int, queries: int = 50) -> list:
+    """Build an IVF index by incremental inserts and time queries, exact and at several nprobe settings, with
+    recall against exact search."""
+    timings = []
+    for n in sizes:
+        vectors, query = clustered_vectors(n, width, queries)
+        index = IVFIndex(os.path.join(os.environ['CACHE_DIR'], f'ann_{n}.npz'))
+        start = time.perf_counter()
+        for i in range(0, n, 1000):
+            index.add([str(j) for j in range(i, min(i + 1000, n))], vectors[i:i + 1000])
+        result = {'n': n, 'insert_seconds': time.perf_counter() - start,
+                  'lists': len(index.centroids) if index.centroids is not None else 0}
+        start = time.perf_counter()
+        exact = [index.search(row, k, exact=True)[0][0] for row in query]
+        result['exact_ms_per_query'] = (time.perf_counter() - start) / queries * 1e3
+        for nprobe in (1, 4, 8, 16, 32):
+            start = time.perf_counter()
+            found = [index.search(row, k, nprobe=nprobe)[0][0] for row in query]
+            result[f'nprobe_{nprobe}'] = {'ms_per_query': (time.perf_counter() - start) / queries * 1e3,
+                                          'recall': recall(found, exact)}
+        result['bytes'] = index.vectors[:index.size].nbytes
+        for storage in STORAGE:
+            if storage == 'float32':
+                continue
+            compressed = IVFIndex(os.path.join(os.environ['CACHE_DIR'], f'ann_{n}_{storage}.npz'), storage=storage)
+            for i in range(0, n, 1000):
+                compressed.add([str(j) for j in range(i, min(i + 1000, n))], vectors[i:i + 1000])
+            start = time.perf_counter()
+            found = [compressed.search(row, k)[0][0] for row in query]
+            result[storage] = {'bytes': compressed.vectors[:compressed.size].nbytes,
+                               'ms_per_query': (time.perf_counter() - start) / queries * 1e3,
+                               'recall': recall(found, exact)}
+        timings.append(result)
+    return timings
+
+
+def bench_quantize(sizes: list, width: int, k: int, queries: int = 50) -> list:
+    """Memory, scoring time and top-<k> recall against float32 of each quantized corpus representation."""
+    reports = []
+    for n in sizes:
+        vectors, query = clustered_vectors(n, width, queries)
+        unit = normalize(vectors)
+        exact_scores = cosine_scores(query, unit)
+        exact = top_k(exact_scores, k)
+        report = {'n': n, 'float32': {'bytes': unit.nbytes,
+                                      'score_seconds': best_time(lambda: cosine_scores(query, unit))}}
+        for mode in QUANTIZERS:
+            start = time.perf_counter()
+            quantized = quantize(vectors, mode)
+            seconds = time.perf_counter() - start
+            scores = cosine_scores(query, quantized)
+            report[mode] = {'bytes': quantized.nbytes, 'compression': unit.nbytes / max(quantized.nbytes, 1),
+                            'quantize_seconds': seconds,
+                            'score_seconds': best_time(lambda: cosine_scores(query, quantized)),
+                            'recall': recall(top_k(scores, k), exact),
+                            'max_score_error': float(np.abs(scores - exact_scores).max(initial=0.))}
+        reports.append(report)
+    return reports
+
+
+def bench_filter(n: int, keywords: str = 'data, machine learning', exclude: str = 'flight attendant') -> dict:
+    """Time filtering <n> cached fixture listings through the listing cache's full text index."""
+    cache = ListingCache(os.path.join(tempfile.mkdtemp(dir=os.environ['CACHE_DIR']), 'filter.sqlite3'),
+                         max_entries=n)
+    start = time.perf_counter()
+    for i in range(n):
+        cache.put(f'http://www.indeed.com/rc/clk?jk={i:08d}', FIXTURES[i % len(FIXTURES)],
+                  TITLES[i % len(TITLES)], 'Seattle', 'WA')
+    put_seconds = time.perf_counter() - start
+    keys = [f'{i:08d}' for i in range(n)]
+    listing_filter = ListingFilter(keywords, exclude, 'WA')
+    passed = cache.matching(keys, listing_filter)
+    seconds = best_time(lambda: cache.matching(keys, listing_filter))
+    cache.close()
+    return {'listings': n, 'fts': cache.fts, 'keywords': keywords, 'exclude': exclude, 'passed': len(passed),
+            'put_seconds': put_seconds, 'seconds': seconds, 'listings_per_sec': n / seconds}
+
+
+def bench_message(num_jobs: int, shorten_delay: float = .05) -> dict:
+    """Time building the email, shortening every url through a provider with <shorten_delay> latency, then again
+    with every short url cached."""
+    listings, _ = synthetic_corpus(num_jobs, 8)
+    finder = offline_finder()
+    finder._url_shortener = stub_shortener(shorten_delay)
+    finder.jobs = listings
+    return {'jobs': num_jobs, 'shorten_delay': shorten_delay,
+            'build_message_seconds': best_time(finder.build_message, 1),
+            'build_message_cached_seconds': best_time(finder.build_message)}
+
+
+@contextmanager
+def local_smtp():
+    """Run an aiosmtpd server that accepts and discards mail; yields its (host, port)."""
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.handlers import Sink
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    controller = Controller(Sink(), hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        yield controller.hostname, controller.port
+    finally:
+        controller.stop()
+
+
+@contextmanager
+def patched(owner, **attributes):
+    """Temporarily replace attributes of <owner>."""
+    originals = {name: owner.__dict__[name] for name in attributes}
+    for name, value in attributes.items():
+        setattr(owner, name, value)
+    try:
+        yield
+    finally:
+        for name, value in originals.items():
+            setattr(owner, name, value)
+
+
+def bench_smtp(smtp: tuple, messages: int, connections: int = 4) -> dict:
+    """Time sending <messages> to different recipients with a new connection each, then over a pool."""
+    listings, _ = synthetic_corpus(10, 8)
+    finder = offline_finder()
+    finder.jobs = listings
+    msgs = []
+    for i in range(messages):
+        finder.email = f'bench{i}@localhost'
+        msgs.append(finder.build_message())
+    connect = smtp_connector(*smtp, starttls=False)
+
+    def send_unpooled() -> None:
+        for msg in msgs:
+            server = connect()
+            server.send_message(msg)
+            server.quit()
+
+    def send_pooled() -> None:
+        pool = SMTPPool(connect, size=connections)
+        mail_queue = MailQueue(pool)
+        for msg in msgs:
+            mail_queue.add(msg)
+        mail_queue.send_all()
+        pool.close()
+    unpooled, pooled = best_time(send_unpooled, 1), best_time(send_pooled, 1)
+    return {'messages': messages, 'connections': connections,
+            'unpooled_seconds': unpooled, 'unpooled_messages_per_sec': messages / unpooled,
+            'pooled_seconds': pooled, 'pooled_messages_per_sec': messages / pooled}
+
+
+def bench_end_to_end(stand_in: IndeedStandIn, smtp: tuple, nlp, pages: int, num_jobs: int, rate: float) -> dict:
+    """Time a whole JobFinder run, answering its prompts programmatically."""
+    resume_path = os.path.join(os.environ['CACHE_DIR'], 'resume.txt')
+    with open(resume_path, 'w') as f:
+        f.write(RESUME)
+    answers = iter([str(pages), str(num_jobs), resume_path, 'bench@localhost', 'Seattle', 'WA', 'data scientist'])
+    start = time.perf_counter()
+    with patched(job_finder.JobFinder,
+                 user_input=staticmethod(lambda prompt: next(answers)),
+                 num_user_input=staticmethod(lambda prompt: int(next(answers))),
+                 initialize_server=staticmethod(lambda: smtplib.SMTP(*smtp))):
+        finder = job_finder.JobFinder.from_user_input(nlp=nlp)
+        finder._url_shortener = stub_shortener()
+        finder.indeed_scraper.base_url = stand_in.url
+        finder.indeed_scraper.url = finder.indeed_scraper.build_url()
+        finder.indeed_scraper.scheduler = RequestScheduler(finder.indeed_scraper.http, rate=rate)
+        finder.main()
+    return {'pages': pages, 'num_jobs': num_jobs, 'jobs_sent': len(finder.jobs),
+            'seconds': time.perf_counter() - start}
+
+
+def load_model(name: str):
+    import spacy
+    if name == 'blank':
+        # Tokenizer only, for machines without a packaged model; its vectors are empty.
+        return spacy.blank('en')
+    return spacy.load(name)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', default='bench_results.json', help='File to write JSON results to.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma separated corpus sizes for rank and dedup.')
+    parser.add_argument('--dedup-max', type=int, default=10000, help='Largest corpus size to deduplicate.')
+    parser.add_argument('--width', type=int, default=96, help='Vector width for synthetic corpora.')
+    parser.add_argument('--pages', type=int, default=10, help='Results pages to scrape.')
+    parser.add_argument('--per-page', type=int, default=15, help='Listings per results page.')
+    parser.add_argument('--latency', type=float, default=.05, help='Maximum stand-in server delay, in seconds.')
+    parser.add_argument('--error-rate', type=float, default=0., help='Fraction of stand-in responses that fail.')
+    parser.add_argument('--request-rate', type=float, default=1000.,
+                        help='Requests a second the scraper may send to the stand-in.')
+    parser.add_argument('--parse-processes', type=int, default=job_finder.PARSE_PROCESSES,
+                        help='Worker processes parsing description pages while scraping; -1 for all cores.')
+    parser.add_argument('--rate-limit', type=float, default=50.,
+                        help='Requests a second a throttling stand-in allows, for the throttled scrape.')
+    parser.add_argument('--num-jobs', type=int, default=10, help='Jobs to find when ranking.')
+    parser.add_argument('--model', default=job_finder.NLP_MODEL,
+                        help='Spacy model for vectorizing and the end to end run; "blank" for an untrained one, '
+                             '"none" to skip both.')
+    parser.add_argument('--repeat', type=int, default=100, help='Repeats for parse timings.')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    results = {'meta': {'time': time.time(), 'commit': git_commit(), 'python': sys.version.split()[0],
+                        'platform': platform.platform(), 'args': vars(args)}}
+    print('Parsing...')
+    results['parse'] = bench_parse(args.repeat)
+    print('Ranking...')
+    results['rank'] = bench_rank(sizes, args.width, args.num_jobs)
+    print('Deduplicating...')
+    results['dedup'] = bench_dedup([n for n in sizes if n <= args.dedup_max], args.width)
+    print('Searching the ANN index...')
+    results['ann'] = bench_ann(sizes, args.width, args.num_jobs)
+    print('Quantizing...')
+    results['quantize'] = bench_quantize(sizes, args.width, args.num_jobs)
+    print('Filtering listings...')
+    results['filter'] = bench_filter(min(max(sizes), args.dedup_max))
+    print('Building messages...')
+    results['message'] = bench_message(2 * args.num_jobs)
+    with IndeedStandIn(per_page=args.per_page, latency=args.latency, error_rate=args.error_rate) as stand_in, \
+            local_smtp() as smtp:
+        print('Scraping...')
+        results['scrape'] = bench_scrape(stand_in, args.pages, args.request_rate, args.parse_processes)
+        print('Sending mail...')
+        results['smtp'] = bench_smtp(smtp, 20)
+        if args.model != 'none':
+            nlp = load_model(args.model)
+            print('Vectorizing...')
+            results['vectorize'] = bench_vectorize(nlp, 200)
+            print('Running end to end...')
+            results['end_to_end'] = bench_end_to_end(stand_in, smtp, nlp, args.pages, args.num_jobs,
+                                                     args.request_rate)
+        print('Comparing ranking engines...')
+        results['engines'] = bench_engines(nlp if args.model != 'none' else None, 1000, args.num_jobs)
+        results['server'] = {'requests': stand_in.requests, 'errors': stand_in.errors}
+    print('Scraping a throttling server...')
+    results['throttled_scrape'] = bench_throttled_scrape(args.pages, args.per_page, args.rate_limit,
+                                                         4 * args.rate_limit)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
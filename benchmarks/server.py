@@ -0,0 +1,161 @@
+import argparse
+import glob
+import html
+import os
+import random
+import threading
+import time
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import examples
+
+FIXTURES = [examples.first, examples.second, examples.third, examples.fourth, examples.fifth, examples.sixth,
+            examples.seventh]
+TITLES = ['Data Science Intern', 'Data Scientist', 'Machine Learning Engineer', 'Analyst', 'Flight Attendant',
+          'Data Engineer', 'Research Scientist']
+
+
+def results_page(page: int, per_page: int) -> bytes:
+    """A search results page linking to <per_page> listings."""
+    rows = ''.join(f'<div class="jobsearch-SerpJobCard unifiedRow row result">'
+                   f'<a class="jobtitle turnstileLink " href="/rc/clk?jk={page:04d}{i:03d}&amp;fccid=bench&amp;vjs=3">'
+                   f'Job {page}-{i}</a><span class="company">Bench Co</span></div>'
+                   for i in range(per_page))
+    return f'<html><head><title>Jobs</title></head><body><div id="resultsCol">{rows}</div></body></html>'.encode()
+
+
+def detail_page(key: str) -> bytes:
+    """A job description page; the text is one of the examples.py listings, chosen by <key>."""
+    i = zlib.crc32(key.encode()) % len(FIXTURES)
+    paragraphs = ''.join(f'<p>{html.escape(paragraph)}</p>' for paragraph in FIXTURES[i].split('\n\n'))
+    return (f'<html><head><script>var jk = "{key}";</script></head><body><div class="jobsearch-ViewJobLayout">'
+            f'<h3 class="icl-u-xs-mb--xs icl-u-xs-mt--none jobsearch-JobInfoHeader-title">{TITLES[i]}</h3>'
+            f'<div class="jobsearch-JobMetadataHeader-item">$50,000 - $70,000 a year</div>'
+            f'<div id="jobDescriptionText" class="jobsearch-jobDescriptionText">{paragraphs}</div>'
+            f'<div class="jobsearch-JobMetadataFooter">Bench Co - {i} days ago</div></div></body></html>').encode()
+
+
+class IndeedStandIn(object):
+    """Local HTTP server answering like Indeed.com search results and job description pages.
+
+    Pages are synthetic, built from the examples.py listings, unless <record_dir> holds recorded pages:
+    `results.html` for every results page and `*.html` description pages, picked by jobkey.
+    Each response is delayed by up to <latency> seconds, and fails with a 503 with probability <error_rate>.
+    With <rate_limit> set, requests beyond that many a second (in bursts of up to <rate_limit>) get a 429 asking
+    the client to retry after a second.
+    """
+
+    def __init__(self, port: int = 0, per_page: int = 15, latency: float = 0., error_rate: float = 0.,
+                 record_dir: str = None, seed: int = 0, rate_limit: float = 0.) -> None:
+        self.per_page = per_page
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.allowance = rate_limit
+        self.allowance_time = time.monotonic()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.recorded_results = None
+        self.recorded_details = []
+        if record_dir:
+            with open(os.path.join(record_dir, 'results.html'), 'rb') as f:
+                self.recorded_results = f.read()
+            for path in sorted(glob.glob(os.path.join(record_dir, '*.html'))):
+                if os.path.basename(path) != 'results.html':
+                    with open(path, 'rb') as f:
+                        self.recorded_details.append(f.read())
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/'
+
+    def start(self) -> 'IndeedStandIn':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'IndeedStandIn':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def respond(self, path: str) -> tuple:
+        """Status code and body for a request to <path>."""
+        with self.lock:
+            self.requests += 1
+            if self.rate_limit:
+                now = time.monotonic()
+                self.allowance = min(self.rate_limit,
+                                     self.allowance + (now - self.allowance_time) * self.rate_limit)
+                self.allowance_time = now
+                if self.allowance < 1:
+                    self.throttled += 1
+                    return 429, b'<html><body>Too Many Requests</body></html>'
+                self.allowance -= 1
+            delay = self.random.uniform(0, self.latency)
+            failed = self.random.random() < self.error_rate
+            self.errors += failed
+        time.sleep(delay)
+        if failed:
+            return 503, b'<html><body>Service Unavailable</body></html>'
+        # Scraped links are joined onto the base url, so paths may start with extra slashes.
+        route, _, query = path.lstrip('/').partition('?')
+        params = parse_qs(query)
+        if route == 'jobs':
+            if self.recorded_results:
+                return 200, self.recorded_results
+            return 200, results_page(int(params.get('start', ['0'])[0]) // 10, self.per_page)
+        if route == 'rc/clk' and params.get('jk'):
+            key = params['jk'][0]
+            if self.recorded_details:
+                return 200, self.recorded_details[zlib.crc32(key.encode()) % len(self.recorded_details)]
+            return 200, detail_page(key)
+        return 404, b'<html><body>Not Found</body></html>'
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                status, body = stand_in.respond(self.path)
+                self.send_response(status)
+                if status == 429:
+                    self.send_header('Retry-After', '1')
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve Indeed.com stand-in pages for benchmarks.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--per-page', type=int, default=15, help='Listings per results page.')
+    parser.add_argument('--latency', type=float, default=0., help='Maximum seconds to delay each response.')
+    parser.add_argument('--error-rate', type=float, default=0., help='Fraction of responses that fail with 503.')
+    parser.add_argument('--rate-limit', type=float, default=0., help='Requests a second before answering 429.')
+    parser.add_argument('--record-dir', help='Directory of recorded pages to serve instead of synthetic ones.')
+    args = parser.parse_args()
+    stand_in = IndeedStandIn(args.port, args.per_page, args.latency, args.error_rate, args.record_dir,
+                             rate_limit=args.rate_limit)
+    print(f'Serving Indeed stand-in at {stand_in.url}')
+    stand_in.server.serve_forever()
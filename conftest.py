@@ -0,0 +1 @@
+# Lets the tests import job_finder, benchmarks and examples from the repository root, however pytest is started.
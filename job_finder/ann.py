@@ -0,0 +1,202 @@
+import numpy as np
+import os
+
+from .dedup import normalize
+from .matching import top_k
+
+# How an index may store its vectors: unit vector values in [-1, 1] as half floats, or as single bytes.
+STORAGE = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+INT8_SCALE = 127
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """<k> unit length centroids of the unit rows of <vectors>, by spherical k-means."""
+    generator = np.random.RandomState(seed)
+    centroids = vectors[generator.choice(len(vectors), k, replace=False)]
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = ~sums.any(axis=1)
+        # Restart empty clusters on random rows rather than losing them.
+        sums[empty] = vectors[generator.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IVFIndex(object):
+    """Persistent inverted file index for cosine similarity search.
+
+    Unit vectors are bucketed by their nearest k-means centroid; a query scores only the rows in the <nprobe>
+    buckets nearest to it, so raising <nprobe> trades speed for recall, and exact=True scores every row.
+    Indexes of fewer than <train_min> rows are always searched exactly. Centroids are trained once the index
+    reaches <train_min> rows and retrained when it has grown fourfold since, so inserts never refit the whole
+    index. Rows are looked up by key; removed rows are tombstoned until more than half the index is dead.
+    Vectors are kept as one of STORAGE: float16 halves the index, int8 quarters it. They are compressed as they
+    are added and only decoded a few rows at a time for scoring.
+    """
+
+    def __init__(self, path: str, nprobe: int = 8, train_min: int = 1024, storage: str = 'float32') -> None:
+        self.path = path
+        self.nprobe = nprobe
+        self.train_min = train_min
+        self.storage = storage
+        # Grown by doubling; rows past <self.size> are spare.
+        self.vectors = np.zeros((0, 0), dtype=STORAGE[storage])
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.keys = []
+        self.ids = {}  # key -> row
+        self.size = 0
+        self.centroids = None
+        self.trained_size = 0
+        self.lists = None  # Rows of each bucket, rebuilt on the first search after a change.
+        if os.path.exists(path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.ids
+
+    def load(self) -> None:
+        with np.load(self.path) as data:
+            self.vectors = data['vectors']
+            if self.vectors.dtype != STORAGE[self.storage]:
+                raise ValueError(f'{self.path} holds {self.vectors.dtype} vectors, not {self.storage}')
+            self.assign = data['assign']
+            self.alive = data['alive']
+            self.keys = data['keys'].tolist()
+            self.centroids = data['centroids'] if data['centroids'].size else None
+            self.trained_size = int(data['trained_size'])
+        self.size = len(self.keys)
+        self.ids = {key: i for i, key in enumerate(self.keys) if self.alive[i]}
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, vectors=self.vectors[:self.size], assign=self.assign[:self.size],
+                     alive=self.alive[:self.size], keys=np.array(self.keys, dtype=str),
+                     centroids=self.centroids if self.centroids is not None else np.zeros((0, 0), np.float32),
+                     trained_size=self.trained_size)
+        os.replace(temp_path, self.path)
+
+    def reserve(self, rows: int, width: int) -> None:
+        if self.vectors.shape[1] != width and self.size:
+            raise ValueError(f'Index holds {self.vectors.shape[1]} wide vectors, not {width}')
+        if rows <= len(self.vectors) and self.vectors.shape[1] == width:
+            return
+        capacity = max(rows, 2 * len(self.vectors), 64)
+        vectors = np.zeros((capacity, width), dtype=self.vectors.dtype)
+        if self.size:
+            vectors[:self.size] = self.vectors[:self.size]
+        self.vectors = vectors
+        self.assign = np.resize(self.assign, capacity)
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive[:self.size]
+        self.alive = alive
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Stored form of unit <vectors>."""
+        if self.storage == 'int8':
+            return np.rint(np.clip(vectors, -1, 1) * INT8_SCALE).astype(np.int8)
+        return vectors.astype(self.vectors.dtype, copy=False)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """Float32 vectors from stored <codes>; float32 codes pass through uncopied."""
+        if self.storage == 'int8':
+            return codes.astype(np.float32) / INT8_SCALE
+        return codes.astype(np.float32, copy=False)
+
+    def nearest_centroid(self, vectors: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        """The nearest centroid to each of <vectors>, which may be stored codes."""
+        return np.concatenate([np.argmax(self.decode(vectors[i:i + chunk]) @ self.centroids.T, axis=1)
+                               for i in range(0, len(vectors), chunk)] or [np.zeros(0, int)]).astype(np.int32)
+
+    def train(self, sample_per_list: int = 32, seed: int = 0) -> None:
+        """Fit about sqrt(n) centroids to a sample of the live rows and rebucket every row."""
+        live = np.flatnonzero(self.alive[:self.size])
+        nlist = max(int(np.sqrt(len(live))), 1)
+        sample = np.sort(np.random.RandomState(seed).choice(live, min(len(live), sample_per_list * nlist),
+                                                            replace=False))
+        self.centroids = spherical_kmeans(self.decode(self.vectors[sample]), nlist, seed=seed)
+        self.assign[:self.size] = self.nearest_centroid(self.vectors[:self.size])
+        self.trained_size = len(live)
+        self.lists = None
+
+    def add(self, keys: list, vectors: np.ndarray) -> None:
+        """Insert or replace the rows for <keys>."""
+        self.remove([key for key in keys if key in self.ids])
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        start = self.size
+        self.reserve(start + len(keys), vectors.shape[1])
+        self.vectors[start:start + len(keys)] = self.encode(vectors)
+        self.alive[start:start + len(keys)] = True
+        for i, key in enumerate(keys):
+            self.ids[key] = start + i
+        self.keys.extend(keys)
+        self.size += len(keys)
+        if self.centroids is not None:
+            self.assign[start:self.size] = self.nearest_centroid(vectors)
+        self.lists = None
+        if len(self) >= max(self.train_min, 4 * self.trained_size) and self.vectors.shape[1]:
+            self.train()
+
+    def remove(self, keys) -> None:
+        """Delete the rows for <keys>, ignoring keys not in the index."""
+        for key in keys:
+            i = self.ids.pop(key, None)
+            if i is not None:
+                self.alive[i] = False
+        if self.size > self.train_min and len(self) < self.size // 2:
+            self.compact()
+
+    def compact(self) -> None:
+        """Drop tombstoned rows."""
+        keep = np.flatnonzero(self.alive[:self.size])
+        self.vectors = self.vectors[keep]
+        self.assign = self.assign[keep]
+        self.alive = np.ones(len(keep), dtype=bool)
+        self.keys = [self.keys[i] for i in keep]
+        self.ids = {key: i for i, key in enumerate(self.keys)}
+        self.size = len(keep)
+        self.lists = None
+
+    def vector(self, key: str) -> np.ndarray:
+        return self.decode(self.vectors[self.ids[key]])
+
+    def bucket_rows(self) -> list:
+        if self.lists is None:
+            order = np.argsort(self.assign[:self.size], kind='stable')
+            bounds = np.searchsorted(self.assign[:self.size][order], np.arange(len(self.centroids) + 1))
+            self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        return self.lists
+
+    def search(self, queries: np.ndarray, k: int, nprobe: int = None, exact: bool = False) -> tuple:
+        """The keys of the <k> rows most similar to each query, best first, and their cosine similarities."""
+        queries = normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        if exact or self.centroids is None:
+            return self.exact_search(queries, k)
+        lists = self.bucket_rows()
+        keys, scores = [], []
+        for query, probe in zip(queries, top_k(queries @ self.centroids.T, nprobe or self.nprobe)):
+            rows = np.concatenate([lists[i] for i in probe])
+            rows = rows[self.alive[rows]]
+            row_scores = self.decode(self.vectors[rows]) @ query
+            best = top_k(row_scores[np.newaxis], k)[0]
+            keys.append([self.keys[i] for i in rows[best]])
+            scores.append(row_scores[best])
+        return keys, scores
+
+    def exact_search(self, queries: np.ndarray, k: int, chunk: int = 65536) -> tuple:
+        """search() scoring every row, for unit <queries>, decoding <chunk> rows at a time."""
+        all_scores = np.concatenate([queries @ self.decode(self.vectors[i:min(i + chunk, self.size)]).T
+                                     for i in range(0, self.size, chunk)] or [np.zeros((len(queries), 0))], axis=1)
+        all_scores[:, ~self.alive[:self.size]] = -np.inf
+        best = top_k(all_scores, min(k, len(self)))
+        return ([[self.keys[i] for i in row] for row in best],
+                [row_scores[row] for row_scores, row in zip(all_scores, best)])
@@ -0,0 +1,203 @@
+import os
+import sqlite3
+import threading
+import time
+
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters Indeed adds to track where a link was clicked, which vary for the same posting.
+TRACKING_PARAMS = {'fccid', 'vjs', 'p', 'fvj', 'tk', 'from'}
+
+
+def job_key(url: str) -> str:
+    """Reduce a job listing url to a stable cache key.
+
+    Indeed identifies a posting by its jobkey (the `jk` or `vjk` query parameter); tracking parameters vary
+    between results pages and runs. Urls without a jobkey, such as sponsored `pagead/clk` links identified by
+    their `ad` token, fall back to the url without its fragment or tracking parameters, its query sorted.
+    """
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    for param in ('jk', 'vjk'):
+        if query.get(param):
+            return query[param][0]
+    params = sorted((name, value) for name, value in parse_qsl(parts.query) if name not in TRACKING_PARAMS)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.replace('//', '/'), urlencode(params),
+                       ''))
+
+
+def split_terms(text: str) -> list:
+    """The comma separated words or phrases in <text>."""
+    return [term.strip() for term in (text or '').split(',') if term.strip()]
+
+
+class ListingFilter(object):
+    """Which listings are worth ranking: those mentioning any of <keywords>, none of <exclude>, found searching
+    <location>.
+
+    <keywords> and <exclude> are comma separated words or phrases, matched against titles and descriptions
+    regardless of case or word endings. <location> is a state, or "City, ST". Empty settings don't filter.
+    """
+
+    def __init__(self, keywords: str = '', exclude: str = '', location: str = '') -> None:
+        self.keywords = split_terms(keywords)
+        self.exclude = split_terms(exclude)
+        city, _, state = (location or '').rpartition(',')
+        self.city = city.strip()
+        self.state = state.strip()
+
+    def __bool__(self) -> bool:
+        return bool(self.keywords or self.exclude or self.city or self.state)
+
+    @staticmethod
+    def text_condition(terms: list, fts: bool) -> tuple:
+        """SQL true for a listings row whose text has any of <terms>, and its parameters."""
+        if fts:
+            query = ' OR '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+            return ('rowid IN (SELECT rowid FROM listings_fts WHERE listings_fts MATCH ?)',
+                    [query])
+        # Without FTS5: an unindexed scan of the rows being filtered.
+        return ('(' + ' OR '.join(["title || ' ' || description LIKE ?"] * len(terms)) + ')',
+                [f'%{term}%' for term in terms])
+
+    def conditions(self, fts: bool = True) -> tuple:
+        """SQL conditions on the listings table, and their parameters."""
+        conditions, params = [], []
+        if self.keywords:
+            condition, terms = self.text_condition(self.keywords, fts)
+            conditions.append(condition)
+            params += terms
+        if self.exclude:
+            condition, terms = self.text_condition(self.exclude, fts)
+            conditions.append(f'NOT {condition}')
+            params += terms
+        for column in ('state', 'city'):
+            if getattr(self, column):
+                conditions.append(f'{column} = ? COLLATE NOCASE')
+                params.append(getattr(self, column))
+        return conditions, params
+
+
+class ListingCache(object):
+    """On disc cache of parsed job listings.
+
+    Stores the title and long form description of each listing, keyed by jobkey, with the time it was fetched.
+    Entries older than <ttl> seconds are treated as misses, and are evicted once older than <max_age> seconds
+    (by default <ttl>); keep them longer to match against past listings. Once the cache holds more than
+    <max_entries> listings the oldest are evicted.
+
+    Each listing also records the city and state searched to find it, and its pay and posting time when its page
+    gave them. Titles and descriptions are indexed for full text search with SQLite's FTS5, if it is available,
+    so matching() can filter listings without reading them.
+    """
+
+    COLUMNS = ('key', 'url', 'title', 'description', 'fetched', 'city', 'state', 'pay', 'posted')
+
+    def __init__(self, path: str, ttl: float = 24 * 60 * 60, max_entries: int = 10000, max_age: float = None) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_age = max(max_age or ttl, ttl)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Scraper threads share one connection; <self.lock> serializes access to it.
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # Rows replaced by INSERT OR REPLACE fire delete triggers, keeping the full text index in step.
+        self.db.execute('PRAGMA recursive_triggers=ON')
+        self.db.execute('CREATE TABLE IF NOT EXISTS listings ('
+                        'key TEXT PRIMARY KEY, url TEXT, title TEXT, description TEXT, fetched REAL, '
+                        'city TEXT, state TEXT, pay TEXT, posted REAL)')
+        # Caches written before listings had locations, pay and posting times.
+        existing = {row[1] for row in self.db.execute('PRAGMA table_info(listings)')}
+        for column, kind in (('city', 'TEXT'), ('state', 'TEXT'), ('pay', 'TEXT'), ('posted', 'REAL')):
+            if column not in existing:
+                self.db.execute(f'ALTER TABLE listings ADD COLUMN {column} {kind}')
+        self.db.execute('CREATE INDEX IF NOT EXISTS listings_fetched ON listings (fetched)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS listings_location ON listings (state, city)')
+        self.fts = self.create_fts()
+        self.db.commit()
+
+    def create_fts(self) -> bool:
+        """Index listing titles and descriptions for full text search. False if SQLite lacks FTS5."""
+        created = not self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'listings_fts'").fetchone()
+        try:
+            # External content: the index points at listings rows by rowid rather than storing the text again.
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5("
+                            "title, description, content='listings', content_rowid='rowid', "
+                            "tokenize='porter unicode61')")
+        except sqlite3.OperationalError:
+            return False
+        self.db.execute('CREATE TRIGGER IF NOT EXISTS listings_fts_insert AFTER INSERT ON listings BEGIN '
+                        'INSERT INTO listings_fts (rowid, title, description) '
+                        'VALUES (new.rowid, new.title, new.description); END')
+        self.db.execute('CREATE TRIGGER IF NOT EXISTS listings_fts_delete AFTER DELETE ON listings BEGIN '
+                        "INSERT INTO listings_fts (listings_fts, rowid, title, description) "
+                        "VALUES ('delete', old.rowid, old.title, old.description); END")
+        if created:
+            self.db.execute("INSERT INTO listings_fts (listings_fts) VALUES ('rebuild')")
+        return True
+
+    def get(self, url: str):
+        """Return the cached (url, description, title) tuple for <url>, or None if missing or expired."""
+        with self.lock:
+            row = self.db.execute('SELECT description, title, fetched FROM listings WHERE key = ?',
+                                  (job_key(url),)).fetchone()
+        if row is None or time.time() - row[2] > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return url, row[0], row[1]
+
+    def put(self, url: str, description: str, title: str, city: str = '', state: str = '', pay: str = None,
+            posted: float = None) -> None:
+        """Store a parsed listing, replacing any previous copy. <posted> is its posting time, if known."""
+        with self.lock:
+            self.db.execute(f'INSERT OR REPLACE INTO listings ({", ".join(self.COLUMNS)}) '
+                            f'VALUES ({", ".join("?" * len(self.COLUMNS))})',
+                            (job_key(url), url, title, description, time.time(), city, state, pay, posted))
+            self.db.commit()
+
+    def lookup(self, keys: list) -> dict:
+        """Map each of <keys> still cached, expired or not, to its (url, description, title) tuple."""
+        found = {}
+        with self.lock:
+            for key in keys:
+                row = self.db.execute('SELECT url, description, title FROM listings WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    found[key] = row
+        return found
+
+    def matching(self, keys: list, listing_filter: ListingFilter) -> set:
+        """The <keys> of cached listings that pass <listing_filter>, checked through the database's indexes."""
+        conditions, params = listing_filter.conditions(self.fts)
+        with self.lock:
+            # One statement over every key, so each full text query runs once rather than once per key.
+            self.db.execute('CREATE TEMP TABLE IF NOT EXISTS filter_keys (key TEXT PRIMARY KEY)')
+            self.db.execute('DELETE FROM filter_keys')
+            self.db.executemany('INSERT OR IGNORE INTO filter_keys VALUES (?)', ((key,) for key in keys))
+            where = ' AND '.join(['key IN filter_keys'] + conditions)
+            found = {key for key, in self.db.execute(f'SELECT key FROM listings WHERE {where}', params)}
+            self.db.commit()
+        return found
+
+    def evict(self) -> list:
+        """Drop listings older than <self.max_age>, then the oldest beyond <self.max_entries>. Returns their keys."""
+        with self.lock:
+            stale = 'SELECT key FROM listings WHERE fetched < ? OR key NOT IN ' \
+                    '(SELECT key FROM listings ORDER BY fetched DESC LIMIT ?)'
+            params = (time.time() - self.max_age, self.max_entries)
+            evicted = [key for key, in self.db.execute(stale, params)]
+            self.db.execute(f'DELETE FROM listings WHERE key IN ({stale})', params)
+            self.db.commit()
+        return evicted
+
+    def close(self) -> None:
+        """Evict stale listings and close the database."""
+        self.evict()
+        with self.lock:
+            self.db.close()
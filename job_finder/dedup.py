@@ -0,0 +1,98 @@
+import numpy as np
+import re
+import zlib
+
+from collections import defaultdict
+
+from .sparse import is_sparse, row_normalize
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """Scale each row of <matrix> to unit length. All zero rows are left as zeros. Sparse matrices stay sparse."""
+    if is_sparse(matrix):
+        return row_normalize(matrix)
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def shingles(text: str, size: int = 5) -> np.ndarray:
+    """Hashes of each run of <size> consecutive words in <text>."""
+    words = re.findall(r'\w+', text.lower())
+    grams = {' '.join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+    return np.array([zlib.crc32(gram.encode('utf-8')) for gram in grams], dtype=np.uint64)
+
+
+class MinHashLSH(object):
+    """Locality sensitive index of MinHash signatures over word shingles.
+
+    Documents whose shingle sets overlap heavily share at least one of <bands> signature bands, so likely
+    duplicates are found without comparing every pair.
+    """
+
+    def __init__(self, bands: int = 16, rows: int = 4, seed: int = 1) -> None:
+        self.bands = bands
+        self.rows = rows
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, 1 << 31, size=bands * rows).astype(np.uint64)
+        self.b = generator.randint(0, 1 << 31, size=bands * rows).astype(np.uint64)
+        self.buckets = defaultdict(list)
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature of the shingles in <text>."""
+        hashes = shingles(text)
+        permuted = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=1)
+
+    def band_keys(self, signature: np.ndarray) -> list:
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def query(self, signature: np.ndarray) -> set:
+        """Ids of indexed documents sharing a band with <signature>."""
+        return {i for key in self.band_keys(signature) for i in self.buckets.get(key, ())}
+
+    def add(self, i: int, signature: np.ndarray) -> None:
+        for key in self.band_keys(signature):
+            self.buckets[key].append(i)
+
+
+def greedy_unique(vectors: np.ndarray, threshold: float = .99, limit: int = None,
+                  texts: list = None, lsh_min: int = 256) -> list:
+    """Indices of rows that are not near duplicates of an earlier kept row, in their original order.
+
+    Row i is kept if its cosine similarity to every row kept before it is below <threshold>; no more than
+    <limit> rows are kept. Small sets compare against all kept rows at once through one similarity matrix.
+    Sets of at least <lsh_min> rows with <texts> only compare rows that a MinHash index of the texts marks as
+    likely duplicates. <vectors> may be a SciPy sparse matrix.
+    """
+    unit = normalize(vectors)
+    limit = unit.shape[0] if limit is None else limit
+    if texts is not None and unit.shape[0] >= lsh_min:
+        return _greedy_unique_lsh(unit, threshold, limit, texts)
+    similarity = unit @ unit.T
+    if is_sparse(similarity):
+        similarity = similarity.toarray()
+    keep = []
+    for i in range(unit.shape[0]):
+        if len(keep) == limit:
+            break
+        if not keep or similarity[i, keep].max() < threshold:
+            keep.append(i)
+    return keep
+
+
+def _greedy_unique_lsh(unit: np.ndarray, threshold: float, limit: int, texts: list) -> list:
+    lsh = MinHashLSH()
+    keep = []
+    for i, text in enumerate(texts):
+        if len(keep) == limit:
+            break
+        signature = lsh.signature(text)
+        candidates = sorted(lsh.query(signature))
+        if not candidates or (unit[candidates] @ unit[i].T).max() < threshold:
+            keep.append(i)
+            lsh.add(i, signature)
+    return keep
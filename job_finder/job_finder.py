@@ -1,15 +1,35 @@
+import argparse
+import multiprocessing
+import numpy as np
 import os
 import smtplib
-import spacy
 import urllib3
 
-from bs4 import BeautifulSoup
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
 from dotenv import load_dotenv
 from email.message import EmailMessage
-from pyshorteners import Shortener
-from sklearn.neighbors import NearestNeighbors
 from tqdm import tqdm
 
+from .ann import STORAGE, IVFIndex
+from .cache import ListingCache, ListingFilter, job_key
+from .dedup import greedy_unique
+from .mail import MailQueue, SMTPPool, smtp_connector
+from .metrics import metrics
+from .matching import cosine_scores, match_profiles, top_k
+from .parsing import default_backend, parse_fields, parse_links, posted_time
+from .pipeline import batches, rank_stream
+from .quantize import QUANTIZERS, quantize
+from .records import Descriptions, Listing, Subset, TextSpool
+from .seen import SeenIndex
+from .shortening import UrlShortener, make_provider
+from .sparse import SPARSE_ENGINES, SparseRanker
+from .startup import ModelLoader, startup_report
+from .throttle import FetchError, RequestScheduler
+from .vectors import VectorStore, model_name, vectorize
+
 # Load environment variables.
 # Docker
 # env_path = '/usr/src/.env'
@@ -22,61 +42,228 @@ PASSWORD = os.getenv('PASSWORD')
 USER_NAME = os.getenv('USER_NAME')
 EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
 API_KEY = os.getenv('API_KEY')
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() in ('1', 'true', 'yes')
+SMTP_CONNECTIONS = int(os.getenv('SMTP_CONNECTIONS', 2))  # Pooled connections for sending many messages at once.
+MAIL_RATE = float(os.getenv('MAIL_RATE', 0))  # Most messages to send a minute, 0 for no limit.
+MAIL_RETRIES = int(os.getenv('MAIL_RETRIES', 3))  # Retries of a message after a transient SMTP error.
+SHORTENER = os.getenv('SHORTENER', 'bitly')  # bitly, stub or none.
+SHORTEN_TIMEOUT = float(os.getenv('SHORTEN_TIMEOUT', 5))  # Seconds to wait for short urls before sending long ones.
+INDEED_URL = os.getenv('INDEED_URL', 'http://www.indeed.com/')
+REQUEST_RATE = float(os.getenv('REQUEST_RATE', 10))  # Most requests a second to one host; lowered if it throttles.
+REQUEST_RETRIES = int(os.getenv('REQUEST_RETRIES', 4))  # Retries of a failed or throttled request.
+NLP_MODEL = os.getenv('NLP_MODEL', 'en_core_web_sm')
+HTML_PARSER = os.getenv('HTML_PARSER') or default_backend()  # lxml, soup or stream.
+SPOOL_MEMORY = int(os.getenv('SPOOL_MEMORY', 16 * 1024 * 1024))  # Bytes of descriptions held before spooling to disc.
+PARSE_PROCESSES = int(os.getenv('PARSE_PROCESSES', 0))  # Worker processes for parsing pages, 0 for none, -1 for all.
+METRICS_PATH = os.getenv('METRICS_PATH')  # Write run metrics here as JSON.
+PROFILE_STAGE = os.getenv('PROFILE_STAGE')  # Profile this stage: scrape, vectorize, rank, dedup, message or smtp.
+PROFILER = os.getenv('PROFILER', 'cprofile')  # cprofile or pyinstrument.
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'job_finder'))
+LISTING_TTL = float(os.getenv('LISTING_TTL', 24 * 60 * 60))  # Seconds before a cached listing is refetched.
+LISTING_CACHE_SIZE = int(os.getenv('LISTING_CACHE_SIZE', 10000))
+LISTING_MAX_AGE = float(os.getenv('LISTING_MAX_AGE', LISTING_TTL))  # Seconds a listing is kept for HISTORY matching.
+HISTORY = os.getenv('HISTORY', '').lower() in ('1', 'true', 'yes')  # Match against every cached listing.
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', 8))  # Index buckets searched for HISTORY matches; more is slower, surer.
+ANN_EXACT = os.getenv('ANN_EXACT', '').lower() in ('1', 'true', 'yes')  # Score every listing in the index instead.
+FILTER_KEYWORDS = os.getenv('FILTER_KEYWORDS', '')  # Only rank listings mentioning one of these, comma separated.
+FILTER_EXCLUDE = os.getenv('FILTER_EXCLUDE', '')  # Never rank listings mentioning one of these, comma separated.
+FILTER_LOCATION = os.getenv('FILTER_LOCATION', '')  # Only rank listings found searching this state or "City, ST".
+VECTOR_BATCH_SIZE = int(os.getenv('VECTOR_BATCH_SIZE', 64))  # Documents per nlp.pipe batch.
+VECTOR_PROCESSES = int(os.getenv('VECTOR_PROCESSES', 1))  # Worker processes for vectorizing, -1 for all cores.
+NEW_ONLY = os.getenv('NEW_ONLY', '').lower() in ('1', 'true', 'yes')  # Skip listings scraped on earlier runs.
+STREAMING = os.getenv('STREAMING', '').lower() in ('1', 'true', 'yes')  # Rank listings as they are scraped.
+SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', .99))  # Listings at least this similar are duplicates.
+QUANTIZATION = os.getenv('QUANTIZATION', 'none')  # Compress description vectors: float16, int8 or pq.
+VECTOR_MAX_AGE = float(os.getenv('VECTOR_MAX_AGE', 30 * 24 * 60 * 60))  # Seconds an unused stored vector is kept.
+RANKING_ENGINE = os.getenv('RANKING_ENGINE', 'spacy')  # spacy, tfidf, bm25 or hybrid.
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', 100))  # Best TF-IDF matches the hybrid engine rescores.
 
 
 class JobFinder(object):
     """Get Indeed.com job listings that match closest with your provided document.
 
-    Use BeautifulSoup4 to scrape Indeed.com for job listings and descriptions.
+    Scrape Indeed.com for job listings and descriptions.
     Use the Spacy NLP library to vectorize each listing and your provided document.
-    Then, use KNN to find listings most relevant to your provided document.
+    Then, rank listings by similarity to find those most relevant to your provided document.
     Get the results right in your email inbox!
 
     User supplies:
     - The number of indeed.com pages to search.
     - The number of search results to return.
     - The email address to send results to.
-    - The file name of your provided document.
+    - The text of your provided document.
     - The city you want to work in.
     - The state that city is in.
     - A search term for the kind of job you're looking for (i.e. Data Scientist).
 
+    A loaded Spacy model, or a ModelLoader still loading one, a vector store and a listing cache may be passed in
+    to share them between searches. The model is only waited for once a stage needs it.
+    Listings failing <listing_filter>, by default the FILTER_ settings, are dropped before anything is vectorized.
+    <self.engine>, RANKING_ENGINE by default, picks how listings are ranked: by Spacy vectors, by hashed TF-IDF
+    or BM25 term weights without loading Spacy at all, or 'hybrid', by TF-IDF and then Spacy for the best few.
+    Use from_user_input() to collect the search from command line prompts.
     """
 
-    def __init__(self):
-        self.pages = self.num_user_input('\nEnter number of pages to search:\n')  # Number of indeed pages to search.
-        self.num_jobs = self.num_user_input('\nEnter max job listings to receive:\n') * 2  # Buffer for duplicates.
-        self.resume = self.load_resume()
-        self.email = self.user_input('\nEnter email:\n')
-        print('\nYou may leave any of the following prompts blank to broaden your search.')
-        self.city = self.user_input('\nEnter desired city:\n').strip().title()
-        self.state = self.user_input('\nEnter state abbreviation:\n').strip().upper()
-        self.terms = self.user_input('\nEnter desired job title:\n').strip().lower()
-        print('\nLoading NLP packages...')
-        self.nlp = spacy.load('en_core_web_sm')
-        self.nn = NearestNeighbors(n_neighbors=self.num_jobs,
-                                   algorithm='ball_tree')
-        self.shortener = Shortener(api_key=API_KEY)
+    def __init__(self, pages: int, num_jobs: int, resume: str, email: str, city: str = '', state: str = '',
+                 terms: str = '', nlp=None, vector_store: VectorStore = None,
+                 listing_cache: ListingCache = None, mail_queue: MailQueue = None,
+                 listing_filter: ListingFilter = None) -> None:
+        self.pages = pages  # Number of indeed pages to search.
+        self.num_jobs = num_jobs * 2  # Buffer for duplicates.
+        self.resume = resume
+        self.email = email
+        self.city = city
+        self.state = state
+        self.terms = terms
+        self.engine = RANKING_ENGINE
+        # Term weight engines never need the model, so it is only loaded up front for the others.
+        self._nlp = nlp if nlp is not None or self.engine in ('tfidf', 'bm25') else ModelLoader(NLP_MODEL).start()
+        self._ranker = None
+        self._vector_store = vector_store
+        self._url_shortener = None
+        self._ann_index = None
+        self.mail_queue = mail_queue  # Messages are left here for the owner to send, if given.
+        if listing_filter is None:
+            listing_filter = ListingFilter(FILTER_KEYWORDS, FILTER_EXCLUDE, FILTER_LOCATION)
+        self.listing_filter = listing_filter
+        self.subject = 'New jobs!!'
         self.jobs = []
+        self.neighbors = []
         self.base_email = EMAIL_ADDRESS
         self.vectors = None
-        self.indeed_scraper = IndeedScraper(self.pages, self.num_jobs, self.city, self.state, self.terms)
-        self.descriptions = self.indeed_scraper.get_descriptions()
-        self.main()
+        self.descriptions = None
+        self.listing_cache = listing_cache or ListingCache(os.path.join(CACHE_DIR, 'listings.sqlite3'),
+                                                           ttl=LISTING_TTL,
+                                                           max_entries=LISTING_CACHE_SIZE,
+                                                           max_age=LISTING_MAX_AGE)
+        self.seen = SeenIndex(os.path.join(CACHE_DIR, 'seen.npy')) if NEW_ONLY else None
+        self.indeed_scraper = IndeedScraper(self.pages, self.num_jobs, self.city, self.state, self.terms,
+                                            cache=self.listing_cache, seen=self.seen)
+
+    @property
+    def nlp(self):
+        """The Spacy model, waiting for it to finish loading if need be."""
+        if self._nlp is None:
+            self._nlp = ModelLoader(NLP_MODEL).start()
+        if isinstance(self._nlp, ModelLoader):
+            if self._nlp.thread.is_alive():
+                print('\nLoading NLP packages...')
+            self._nlp = self._nlp.get()
+        return self._nlp
+
+    @property
+    def vector_store(self) -> VectorStore:
+        if self._vector_store is None:
+            self._vector_store = VectorStore(os.path.join(CACHE_DIR, 'vectors'), model_name(self.nlp),
+                                             max_age=VECTOR_MAX_AGE)
+        return self._vector_store
+
+    @property
+    def sparse_ranking(self) -> bool:
+        """Whether listings are ranked by term weights, whose vectors are SciPy sparse matrices."""
+        return self.engine in SPARSE_ENGINES
+
+    @property
+    def ranker(self) -> SparseRanker:
+        if self._ranker is None:
+            self._ranker = SparseRanker('bm25' if self.engine == 'bm25' else 'tfidf')
+        return self._ranker
+
+    @property
+    def url_shortener(self) -> UrlShortener:
+        if self._url_shortener is None:
+            self._url_shortener = UrlShortener(make_provider(SHORTENER, API_KEY),
+                                               os.path.join(CACHE_DIR, 'short_urls.sqlite3'),
+                                               timeout=SHORTEN_TIMEOUT)
+        return self._url_shortener
+
+    @property
+    def ann_index(self) -> IVFIndex:
+        """Index of the vectors of every cached listing, for HISTORY matching, compressed as QUANTIZATION says if
+        the index can store them that way.
+        """
+        if self._ann_index is None:
+            storage = QUANTIZATION if QUANTIZATION in STORAGE else 'float32'
+            name = model_name(self.nlp) + ('' if storage == 'float32' else f'-{storage}')
+            self._ann_index = IVFIndex(os.path.join(CACHE_DIR, 'ann', f'{name}.npz'), nprobe=ANN_NPROBE,
+                                       storage=storage)
+        return self._ann_index
+
+    @classmethod
+    def from_user_input(cls, **kwargs) -> 'JobFinder':
+        """Prompt the user for their search. <kwargs> are passed on to JobFinder."""
+        pages = cls.num_user_input('\nEnter number of pages to search:\n')
+        num_jobs = cls.num_user_input('\nEnter max job listings to receive:\n')
+        resume = cls.load_resume()
+        email = cls.user_input('\nEnter email:\n')
+        print('\nYou may leave any of the following prompts blank to broaden your search.')
+        city = cls.user_input('\nEnter desired city:\n').strip().title()
+        state = cls.user_input('\nEnter state abbreviation:\n').strip().upper()
+        terms = cls.user_input('\nEnter desired job title:\n').strip().lower()
+        return cls(pages, num_jobs, resume, email, city, state, terms, **kwargs)
 
     def main(self) -> None:
         """Calls all methods needed to complete program."""
         # print(f"\nFound {len(descriptions)} jobs.")
 
-        self.vectors = self.get_description_vectors()
-        self.get_best_jobs()
+        if STREAMING and not self.sparse_ranking:
+            self.stream_best_jobs()
+        else:
+            with metrics.stage('scrape'):
+                descriptions = self.indeed_scraper.get_descriptions()
+            self.rank_descriptions(descriptions)
+        evicted = self.listing_cache.evict()
+        if HISTORY and not self.sparse_ranking:
+            self.ann_index.remove(evicted)
+            self.ann_index.save()
         self.remove_duplicates()
         self.email_jobs()
+        if self.seen is not None:
+            # Only once the email is out, so a failed run's listings count as new next time.
+            self.seen.save()
+
+    def rank_descriptions(self, descriptions: list) -> None:
+        """Vectorize already scraped <descriptions> and find the best matches among them."""
+        self.descriptions = self.filter_descriptions(descriptions)
+        if self.listing_filter:
+            print(f'\n{len(self.descriptions)} of {len(descriptions)} listings pass the filters.')
+        self.jobs = []
+        # With HISTORY the index compresses the vectors it keeps instead, and must be given the originals.
+        quantizing = QUANTIZATION in QUANTIZERS and not self.sparse_ranking and not HISTORY
+        self.vectors = self.get_description_vectors(lazy=quantizing)
+        if quantizing:
+            # Compressed a chunk of stored rows at a time. Ranking scores the compressed matrix directly; dedup
+            # decodes just the candidates.
+            self.vectors = quantize(self.vectors, QUANTIZATION, self.vector_store.codebook_path(QUANTIZATION))
+        self.get_best_jobs()
 
-    def load_resume(self) -> str:
+    def filter_descriptions(self, descriptions: list) -> list:
+        """The <descriptions> passing <self.listing_filter>, found by querying the listing cache they were stored
+        in when scraped.
+        """
+        if not self.listing_filter:
+            return descriptions
+        with metrics.stage('filter'):
+            keys = [job_key(description[0]) for description in descriptions]
+            passed = self.listing_cache.matching(keys, self.listing_filter)
+        metrics.count('listings_filtered', len(descriptions) - len(passed))
+        return [description for description, key in zip(descriptions, keys) if key in passed]
+
+    def filter_stream(self, descriptions):
+        """Yield the listings of the iterable <descriptions> that pass <self.listing_filter>, checked in batches."""
+        if not self.listing_filter:
+            yield from descriptions
+            return
+        for batch in batches(descriptions, VECTOR_BATCH_SIZE):
+            yield from self.filter_descriptions(batch)
+
+    @classmethod
+    def load_resume(cls) -> str:
         """Load resume text from disc."""
         while True:
-            path = self.user_input('\nEnter document file name:\n')
+            path = cls.user_input('\nEnter document file name:\n')
             if path[-3:] != "txt":
                 print(f'\n{"-" * 20}')
                 print('File name must end in ".txt"')
@@ -114,132 +301,416 @@ class JobFinder(object):
                 print('\nPlease enter a number.\n')
                 continue
 
-    def get_description_vectors(self) -> list:
-        """Get Spacy vectors for each long form job description."""
+    def vectorize(self, texts: list, progress: bool = True) -> np.ndarray:
+        """Get a matrix of Spacy vectors for <texts>, one row per text."""
+        return vectorize(self.nlp, texts,
+                         batch_size=VECTOR_BATCH_SIZE,
+                         n_process=VECTOR_PROCESSES,
+                         progress=progress)
+
+    def get_description_vectors(self, lazy: bool = False):
+        """Get Spacy vectors for each long form job description.
+
+        Descriptions vectorized on a previous run are read from <self.vector_store>; with <lazy>, only as the
+        returned rows are indexed.
+        With a term weight engine, returns a sparse matrix of the descriptions' term weights instead.
+        """
         print('\nGetting description vectors...\n')
-        return [self.nlp(doc).vector for _, doc, _ in tqdm(self.descriptions)]
+        with metrics.stage('vectorize'):
+            if self.sparse_ranking:
+                return self.ranker.fit(Descriptions(self.descriptions))
+            return self.vector_store.vectors_for(Descriptions(self.descriptions), self.vectorize, lazy=lazy)
+
+    def get_document_vectors(self, documents: list) -> np.ndarray:
+        """Get Spacy vectors for resumes or other user documents, one row per document."""
+        with metrics.stage('vectorize'):
+            return self.vector_store.vectors_for(documents, lambda texts: self.vectorize(texts, progress=False))
 
     def get_best_jobs(self) -> None:
-        """Vectorize resume and fit a nearest neighbors classifier to find desired number of jobs."""
+        """Vectorize resume and rank descriptions by cosine similarity to find desired number of jobs."""
         print(f'\nFinding best {self.num_jobs // 2} job matches...\n')
-        self.nn.fit(self.vectors)
-        neighbors = list(self.nn.kneighbors([self.nlp(self.resume).vector], self.num_jobs, return_distance=False)[0])
-        for neighbor in neighbors:
+        if not len(self.descriptions):
+            # Nothing to rank, and an empty store doesn't know its vectors' width.
+            self.neighbors = []
+            return
+        if self.sparse_ranking:
+            self.neighbors = self.sparse_best_jobs()
+        else:
+            self.neighbors = self.spacy_best_jobs()
+        for neighbor in self.neighbors:
             self.jobs.append(self.descriptions[neighbor])
+        self.prefetch_short_urls()
+
+    def prefetch_short_urls(self) -> None:
+        """Start shortening the urls of the jobs most likely to be sent while duplicates are removed.
+
+        Only the best <self.num_jobs // 2> candidates, as many as will be sent, so duplicates dropped further down
+        don't spend calls to a rate limited API; shorten() fetches any kept job beyond them when the email is built.
+        """
+        self.url_shortener.submit([job[0] for job in self.jobs[:self.num_jobs // 2]])
+
+    def spacy_best_jobs(self) -> list:
+        """Indices of the descriptions whose Spacy vectors are most similar to the resume's, best first."""
+        resume_vector = self.get_document_vectors([self.resume])
+        with metrics.stage('rank'):
+            if HISTORY:
+                return self.search_history(resume_vector)
+            return [int(i) for i in top_k(cosine_scores(resume_vector, self.vectors), self.num_jobs)[0]]
+
+    def sparse_best_jobs(self) -> list:
+        """Indices of the descriptions whose term weights best match the resume's, best first.
+
+        The hybrid engine takes the best HYBRID_CANDIDATES by TF-IDF, then vectorizes only those with Spacy and
+        reranks them by cosine similarity to the resume.
+        """
+        with metrics.stage('rank'):
+            scores = self.ranker.score([self.resume], self.vectors)
+            if self.engine != 'hybrid':
+                return [int(i) for i in top_k(scores, self.num_jobs)[0]]
+            candidates = top_k(scores, max(HYBRID_CANDIDATES, self.num_jobs))[0]
+        with metrics.stage('vectorize'):
+            candidate_vectors = self.vector_store.vectors_for(Subset(Descriptions(self.descriptions), candidates),
+                                                              self.vectorize)
+        resume_vector = self.get_document_vectors([self.resume])
+        with metrics.stage('rank'):
+            best = top_k(cosine_scores(resume_vector, candidate_vectors), self.num_jobs)[0]
+        return [int(candidates[i]) for i in best]
+
+    def search_history(self, resume_vector: np.ndarray) -> list:
+        """Add this run's listings to the ANN index and find the best matches among every indexed listing.
+
+        <self.descriptions> and <self.vectors> are replaced by the matches, which may include listings from
+        earlier runs read back from the listing cache; returns their indices, best first. Earlier listings must
+        pass <self.listing_filter> too, so more matches are searched for while filtered ones leave too few.
+        """
+        current = {job_key(description[0]): i for i, description in enumerate(self.descriptions)}
+        self.ann_index.add(list(current), self.vectors[list(current.values())])
+        wanted = self.num_jobs
+        while True:
+            keys = self.ann_index.search(resume_vector, wanted, exact=ANN_EXACT)[0][0]
+            if not self.listing_filter:
+                break
+            passed = self.listing_cache.matching(keys, self.listing_filter)
+            found = len(keys)
+            keys = [key for key in keys if key in passed]
+            if len(keys) >= self.num_jobs or found < wanted or wanted >= len(self.ann_index):
+                keys = keys[:self.num_jobs]
+                break
+            wanted *= 4
+        earlier = self.listing_cache.lookup([key for key in keys if key not in current])
+        matches = [(key, self.descriptions[current[key]] if key in current else earlier.get(key)) for key in keys]
+        # Listings evicted from the cache since they were indexed can't be sent.
+        matches = [(key, listing) for key, listing in matches if listing is not None]
+        self.descriptions = [listing for _, listing in matches]
+        self.vectors = np.array([self.ann_index.vector(key) for key, _ in matches],
+                                dtype=np.float32).reshape(len(matches), self.vectors.shape[1])
+        return list(range(len(matches)))
+
+    def match_documents(self, documents: list, num_jobs) -> list:
+        """Find the best jobs among the scraped descriptions for each of several resumes or ideal job descriptions.
+
+        All documents are scored against the descriptions at once. <num_jobs> is the number of jobs wanted,
+        for every document or as a list with one count per document. Returns one list of jobs per document.
+        With a term weight engine, documents are compared by the cosine similarity of their term weights.
+        """
+        if self.sparse_ranking:
+            profiles = self.ranker.transform_queries(documents)
+        else:
+            profiles = self.get_document_vectors(documents)
+        matches = match_profiles(profiles, self.vectors, num_jobs,
+                                 threshold=SIMILARITY_THRESHOLD,
+                                 texts=Descriptions(self.descriptions))
+        return [[self.descriptions[i] for i in match] for match in matches]
+
+    def stream_best_jobs(self, provisional=None) -> None:
+        """Find the best job matches while listings are still being scraped.
+
+        Each listing is vectorized and scored against the resume as soon as it is fetched, and only the running
+        best <self.num_jobs> are kept, so memory does not grow with the number of pages searched.
+        <provisional>, if given, is called with the current best jobs after every batch.
+        """
+        print(f'\nFinding best {self.num_jobs // 2} job matches as listings arrive...\n')
+
+        def embed(texts: list) -> np.ndarray:
+            with metrics.stage('vectorize'):
+                return self.vector_store.vectors_for(texts, lambda new: self.vectorize(new, progress=False),
+                                                     save=False)
+
+        ranked = []
+        with metrics.stage('stream'):
+            descriptions = self.filter_stream(self.indeed_scraper.iter_descriptions())
+            # The resume is vectorized once the first listings are in, so scraping starts while the model loads.
+            for ranked in rank_stream(descriptions, embed, lambda: self.get_document_vectors([self.resume])[0],
+                                      self.num_jobs, batch_size=VECTOR_BATCH_SIZE):
+                if provisional:
+                    provisional([listing for listing, _ in ranked])
+        self.vector_store.save()
+        self.jobs = [listing for listing, _ in ranked]
+        self.vectors = np.array([vector for _, vector in ranked], dtype=np.float32)
+        self.neighbors = list(range(len(ranked)))
+        self.prefetch_short_urls()
 
     def remove_duplicates(self) -> None:
-        """Use Spacy's similarity function to weed out duplicate job descriptions."""
-        final_jobs = [self.jobs[0]]
-        for job in tqdm(self.jobs[1:]):
-            doc1 = self.nlp(job[1])
-            # Compare the similarity of <job> to each doc in <final_jobs>.
-            # If <job> matches any of <final_jobs> reject <job>.
-            if all([doc1.similarity(self.nlp(doc[1])) < .99 for doc in final_jobs]):
-                final_jobs.append(job)
-                # Don't include more jobs than were asked for.
-                if len(final_jobs) == self.num_jobs // 2:
-                    break
-        self.jobs = final_jobs.copy()
+        """Use the description vectors' cosine similarity to weed out duplicate job descriptions.
+
+        A job is rejected if it matches any better ranked job that was kept.
+        Don't include more jobs than were asked for.
+        """
+        if not self.jobs:
+            return
+        with metrics.stage('dedup'):
+            keep = greedy_unique(self.vectors[self.neighbors],
+                                 threshold=SIMILARITY_THRESHOLD,
+                                 limit=self.num_jobs // 2,
+                                 texts=Descriptions(self.jobs))
+        self.jobs = [self.jobs[i] for i in keep]
 
     def email_jobs(self) -> None:
-        """Send list of jobs to user."""
+        """Send list of jobs to user, or queue it on <self.mail_queue>."""
+        if not self.jobs:
+            print('\nNo new jobs found.')
+            return
         print('\nEmailing jobs...\n')
-        msg = self.build_message()
-        server = self.initialize_server()
-        self.send_and_deactivate(server, msg)
+        with metrics.stage('message'):
+            msg = self.build_message()
+        if self.mail_queue is not None:
+            self.mail_queue.add(msg)
+            return
+        with metrics.stage('smtp'):
+            pool = SMTPPool(self.initialize_server)
+            mail_queue = MailQueue(pool, retries=MAIL_RETRIES)
+            mail_queue.add(msg)
+            failed = mail_queue.send_all()
+            pool.close()
+        if failed:
+            raise failed[0][1]
+        print("You've got mail!!")
 
     def build_message(self) -> EmailMessage:
         """Create EmailMessage instance."""
         msg = EmailMessage()
-        msg['subject'] = 'New jobs!!'
+        msg['subject'] = self.subject
         msg['from'] = self.base_email
         msg['to'] = self.email
         div = '\n' + '*-' * 20 + '\n'
-        msg.set_content(f'{div}'.join([job[2] + '\n\n' + self.shortener.bitly.short(job[0]) + '\n\n' + job[1] + '\n\n'
+        short_urls = self.url_shortener.shorten([job[0] for job in self.jobs])
+        msg.set_content(f'{div}'.join([job[2] + '\n\n' + short_urls[job[0]] + '\n\n' + job[1] + '\n\n'
                                        for job in self.jobs]))  # job == (url, description, title)
 
         return msg
 
     @staticmethod
     def initialize_server() -> smtplib.SMTP:
-        """Start a Gmail smtp server."""
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        # server.set_debuglevel(1)
-        server.starttls()
-        server.login(USER_NAME, PASSWORD)
-        return server
-
-    @staticmethod
-    def send_and_deactivate(server: smtplib.SMTP, msg: EmailMessage) -> None:
-        """Send <msg> and deactivate <server>. Print confirmation message."""
-        server.send_message(msg)
-        server.quit()
-        print("You've got mail!!")
+        """Connect to the smtp server, Gmail by default."""
+        return smtp_connector(SMTP_HOST, SMTP_PORT, USER_NAME, PASSWORD, starttls=SMTP_STARTTLS)()
 
 
 class IndeedScraper(object):
-    def __init__(self, pages: int, num_jobs: int, city: str, state: str, terms: str) -> None:
+    def __init__(self, pages: int, num_jobs: int, city: str, state: str, terms: str,
+                 max_workers: int = 16, host_limit: int = 8, cache: ListingCache = None,
+                 max_pending: int = 64, parser: str = HTML_PARSER, base_url: str = INDEED_URL,
+                 scheduler: RequestScheduler = None, seen: SeenIndex = None,
+                 parse_processes: int = PARSE_PROCESSES) -> None:
         self.pages = pages
         self.num_jobs = num_jobs
         self.city = city
         self.state = state
         self.terms = terms
+        self.base_url = base_url
         self.url = self.build_url()
-        self.http = urllib3.PoolManager()
+        self.max_workers = max_workers
+        # Blocking pools cap the number of open connections, and so concurrent requests, per host.
+        self.http = urllib3.PoolManager(maxsize=host_limit, block=True)
+        self.scheduler = scheduler or RequestScheduler(self.http, rate=REQUEST_RATE, retries=REQUEST_RETRIES)
+        self.skipped_pages = 0  # Pages given up on, leaving the results partial.
+        self.skipped_descriptions = 0
+        self.cache = cache
+        self.seen = seen  # Jobkeys of listings from earlier runs, to skip; this run's are added.
+        self.max_pending = max_pending  # Description pages fetched ahead of the consumer.
+        self.parser = parser
+        # Description pages are parsed in this many worker processes, rather than on the fetching threads.
+        self.parse_processes = os.cpu_count() if parse_processes < 0 else parse_processes
+        self.parse_pool = None
+        self.spool = TextSpool(SPOOL_MEMORY)  # Descriptions of this scraper's listings, compressed.
         self.descriptions = None
 
     def build_url(self) -> str:
         """Builds search url from user input."""
-        url = f'http://www.indeed.com/jobs?q=' \
+        url = f'{self.base_url}jobs?q=' \
               f"{'%20'.join(self.terms.split())}&l={'%20'.join(self.city.split())},%20{self.state}"
         print(f'\nIndeed search URL: {url}')
         return url
 
-    @staticmethod
-    def find_long_descriptions(soup) -> list:
+    def find_long_descriptions(self, html: bytes) -> list:
         """Create list of urls for long form job descriptions."""
+        try:
+            return parse_links(html, self.parser)
+        except Exception as error:  # One unparseable results page must not stop the scrape.
+            print(f'\nSkipping results page: {error!r}')
+            self.skipped_pages += 1
+            metrics.count('pages_skipped')
+            return []
+
+    def new_links(self, links: list, run_keys: set) -> list:
+        """The urls among <links> whose jobkey is not in <run_keys> or <self.seen>, adding their keys to <run_keys>.
+
+        Results pages repeat postings under different tracking parameters, so links are compared by jobkey before
+        any description is fetched.
+        """
         urls = []
-        for div in soup.find_all(name='div',
-                                 attrs={'class': 'row'}):
-            for a in div.find_all(name='a',
-                                  attrs={'class': 'jobtitle turnstileLink'}):
-                urls.append(a['href'])
+        for link in links:
+            url = self.base_url + link
+            key = job_key(url)
+            if key in run_keys:
+                metrics.count('repeated_links')
+                continue
+            run_keys.add(key)
+            if self.seen is not None and key in self.seen:
+                metrics.count('seen_links')
+                continue
+            urls.append(url)
         return urls
 
+    def mark_seen(self, description: tuple) -> None:
+        """Record a scraped listing in <self.seen>, if kept; listings that failed to fetch stay new."""
+        if self.seen is not None:
+            self.seen.add(job_key(description[0]))
+
     def get_next_pages(self) -> list:
         """Create a list of top level pages to search."""
         return [self.url] + [self.url + f'&start={x}0' for x in range(1, self.pages)]
 
+    def get_page(self, url: str):
+        """Fetch a top level search results page, or None if it can't be fetched."""
+        try:
+            with metrics.timer('fetch_page_seconds'):
+                data = self.scheduler.request('GET', url).data
+        except FetchError as error:
+            print(f'\nSkipping results page: {error}')
+            self.skipped_pages += 1
+            metrics.count('pages_skipped')
+            return None
+        metrics.count('bytes_downloaded', len(data))
+        return data
+
+    def get_description(self, url: str):
+        """Fetch a long form job description page and parse out its title and text.
+
+        Returns a Listing, or None if the page has no description; its text is kept in <self.spool>.
+        Listings found in <self.cache> are returned without fetching or parsing.
+        """
+        if self.cache:
+            cached = self.cache.get(url)
+            metrics.count('cache_hits' if cached else 'cache_misses')
+            if cached:
+                return Listing(*cached, self.spool)
+        try:
+            with metrics.timer('fetch_description_seconds'):
+                req = self.scheduler.request('GET',
+                                             url,
+                                             headers={'User-Agent': 'opera'})
+        except FetchError:
+            self.skipped_descriptions += 1
+            metrics.count('descriptions_skipped')
+            return None
+        metrics.count('bytes_downloaded', len(req.data))
+        try:
+            with metrics.timer('parse_seconds'):
+                fields = self.parse(req.data)
+        except Exception as error:  # One unparseable page must not stop the scrape.
+            print(f'\nSkipping job description {url}: {error!r}')
+            self.skipped_descriptions += 1
+            metrics.count('descriptions_skipped')
+            return None
+        if fields['description']:
+            # Some pages have no title header; keep the listing anyway.
+            title = fields['title'] or ''
+            if self.cache:
+                self.cache.put(url, fields['description'], title, city=self.city, state=self.state,
+                               pay=(fields['pay'] or '').strip() or None, posted=posted_time(fields['posted']))
+            return Listing(url, fields['description'], title, self.spool)
+        return None
+
+    def parse(self, html: bytes) -> dict:
+        """Fields of a description page, parsed in <self.parse_pool> if there is one.
+
+        Only the page bytes go to the worker and only the extracted fields come back; the fetching thread waits
+        meanwhile, so other threads keep fetching.
+        """
+        if self.parse_pool is None:
+            return parse_fields(html, self.parser)
+        return self.parse_pool.submit(parse_fields, html, self.parser).result()
+
+    def iter_descriptions(self):
+        """Yield tuples containing job url, long form job description, and job description title.
+
+        Top level pages and description pages are fetched concurrently; description pages are queued as soon as
+        the page linking to them arrives. Listings are yielded in search page order, so rankings are reproducible,
+        and no more than <self.max_workers> top level pages and <self.max_pending> description pages are held
+        in flight at once. Each posting is fetched once, however many pages link to it, and not at all if it is
+        in <self.seen>. Pages that can't be fetched, even after retries, are skipped and counted in
+        <self.skipped_pages> and <self.skipped_descriptions>.
+        """
+        print('\nGetting Indeed job descriptions...\n')
+        page_urls = iter(self.get_next_pages())
+        run_keys = set()
+        # Spawned, not forked, workers: the model may be loading on another thread.
+        self.parse_pool = ProcessPoolExecutor(self.parse_processes, mp_context=multiprocessing.get_context('spawn')) \
+            if self.parse_processes else None
+        with self.parse_pool or nullcontext(), \
+                ThreadPoolExecutor(max_workers=max(self.max_workers, self.parse_processes)) as executor:
+            pages = deque(executor.submit(self.get_page, base_url)
+                          for base_url in islice(page_urls, self.max_workers))
+            jobs = deque()
+            progress = tqdm(total=self.pages)
+            while pages:
+                base_page = pages.popleft().result()
+                progress.update()
+                next_url = next(page_urls, None)
+                if next_url:
+                    pages.append(executor.submit(self.get_page, next_url))
+                if base_page is None:
+                    continue
+                # Follow links to each job description on the page.
+                for url in self.new_links(self.find_long_descriptions(base_page), run_keys):
+                    jobs.append(executor.submit(self.get_description, url))
+                while len(jobs) > self.max_pending:
+                    description = jobs.popleft().result()
+                    if description:
+                        self.mark_seen(description)
+                        yield description
+            progress.close()
+            while jobs:
+                description = jobs.popleft().result()
+                if description:
+                    self.mark_seen(description)
+                    yield description
+        self.parse_pool = None
+        if self.skipped_pages or self.skipped_descriptions:
+            print(f'\nResults are partial: skipped {self.skipped_pages} results pages and '
+                  f'{self.skipped_descriptions} job descriptions that could not be fetched.')
+
     def get_descriptions(self) -> list:
         """Create a list of tuples containing job url, job description title,
         and long form job descriptions.
         """
-        print('\nGetting Indeed job descriptions...\n')
-        descriptions = []
-        # Get and parse each top level page.
-        for base_url in tqdm(self.get_next_pages()):
-            request = self.http.request('GET',
-                                        base_url)
-            base_soup = BeautifulSoup(request.data, 'html.parser')
-            # Follow links to each job description on the page.
-            for url in self.find_long_descriptions(base_soup):
-                the_url = "http://www.indeed.com/" + url
-                req = self.http.request('GET',
-                                        the_url,
-                                        headers={'User-Agent': 'opera'},
-                                        retries=urllib3.Retry(connect=500,
-                                                              read=2,
-                                                              redirect=50))
-                # Parse out title and text from each description page and put it in the descriptions list.
-                soup = BeautifulSoup(req.data, 'html.parser')
-                title = soup.find(name='h3',
-                                  attrs={'class': 'icl-u-xs-mb--xs icl-u-xs-mt--none jobsearch-JobInfoHeader-title'})
-                description = soup.find(name='div',
-                                        attrs={'id': 'jobDescriptionText'})
-                if description:
-                    descriptions.append((the_url, description.text, title.text))
-        return descriptions
+        return list(self.iter_descriptions())
 
 
 if __name__ == "__main__":
-    scraper = JobFinder()
+    parser = argparse.ArgumentParser(description='Email yourself the Indeed.com job listings closest to your document.')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Print import and model load times when done.')
+    parser.add_argument('--metrics', default=METRICS_PATH, help='Write stage timings and counters here as JSON.')
+    parser.add_argument('--profile-stage', default=PROFILE_STAGE, help='Profile one stage of the run.')
+    args = parser.parse_args()
+    metrics.profile_stage = args.profile_stage
+    metrics.profiler = PROFILER
+    # Load the model while the user answers prompts and listings are scraped, unless it won't be used.
+    model = None if RANKING_ENGINE in ('tfidf', 'bm25') else ModelLoader(NLP_MODEL).start()
+    scraper = JobFinder.from_user_input(nlp=model)
+    scraper.main()
+    if args.profile_startup:
+        print(startup_report(model))
+    if args.metrics:
+        metrics.write_json(args.metrics)
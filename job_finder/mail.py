@@ -0,0 +1,170 @@
+import queue
+import random
+import smtplib
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.message import EmailMessage
+
+from .metrics import metrics
+
+
+def smtp_connector(host: str, port: int, user: str = None, password: str = None, starttls: bool = True,
+                   timeout: float = 30):
+    """A function opening an SMTP connection to <host>, upgraded with STARTTLS and logged in if <user> is given."""
+    def connect() -> smtplib.SMTP:
+        server = smtplib.SMTP(host, port, timeout=timeout)
+        if starttls:
+            server.starttls()
+        if user:
+            server.login(user, password)
+        return server
+    return connect
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether sending again later might succeed: dropped connections and 4xx replies."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError))
+
+
+class SMTPPool(object):
+    """Up to <size> open SMTP connections, each made by <connect> once and reused for many messages."""
+
+    def __init__(self, connect, size: int = 1) -> None:
+        self.connect = connect
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection. It goes back to the pool unless it failed other than by the server refusing."""
+        with self.slots:
+            try:
+                server = self.idle.get_nowait()
+            except queue.Empty:  # Checking empty() first would race other threads for the last one.
+                server = None
+            if server is not None and not self.alive(server):
+                server = None
+            if server is None:
+                with metrics.timer('smtp_connect_seconds'):
+                    server = self.connect()
+                metrics.count('smtp_connections')
+            try:
+                yield server
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                self.idle.put(server)  # The server answered, so the connection is still good.
+                raise
+            except Exception:
+                self.close_quietly(server)
+                raise
+            self.idle.put(server)
+
+    @staticmethod
+    def alive(server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def close_quietly(server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def close(self) -> None:
+        while not self.idle.empty():
+            self.close_quietly(self.idle.get_nowait())
+
+
+class RateLimiter(object):
+    """Space calls at least 60 / <per_minute> seconds apart, across threads."""
+
+    def __init__(self, per_minute: float = None) -> None:
+        self.interval = 60. / per_minute if per_minute else 0.
+        self.lock = threading.Lock()
+        self.next_time = 0.
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            delay = max(self.next_time - now, 0.)
+            self.next_time = max(self.next_time, now) + self.interval
+        time.sleep(delay)
+
+
+def merge_digests(messages: list) -> list:
+    """Merge messages to the same recipient into one, keeping each message's subject as a section heading."""
+    by_recipient = OrderedDict()
+    for msg in messages:
+        by_recipient.setdefault(msg['to'], []).append(msg)
+    merged = []
+    for recipient, group in by_recipient.items():
+        if len(group) == 1:
+            merged.append(group[0])
+            continue
+        msg = EmailMessage()
+        msg['subject'] = f'New jobs!! ({len(group)} searches)'
+        msg['from'] = group[0]['from']
+        msg['to'] = recipient
+        rule = '=' * 40
+        msg.set_content('\n\n'.join(f"{rule}\n{part['subject']}\n{rule}\n\n{part.get_content()}" for part in group))
+        merged.append(msg)
+    return merged
+
+
+class MailQueue(object):
+    """Messages waiting to be delivered through an SMTPPool.
+
+    send_all() delivers them over the pool's connections in parallel, no faster than <per_minute> messages a
+    minute, retrying transient failures up to <retries> times with jittered exponential backoff starting at
+    <backoff> seconds. Pass digest=True to merge messages to the same recipient first.
+    """
+
+    def __init__(self, pool: SMTPPool, per_minute: float = None, retries: int = 3, backoff: float = 1.) -> None:
+        self.pool = pool
+        self.limiter = RateLimiter(per_minute)
+        self.retries = retries
+        self.backoff = backoff
+        self.messages = []
+
+    def add(self, msg: EmailMessage) -> None:
+        self.messages.append(msg)
+
+    def send(self, msg: EmailMessage) -> None:
+        """Deliver one message, retrying transient failures."""
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                with self.pool.connection() as server:
+                    server.send_message(msg)
+                metrics.count('emails_sent')
+                return
+            except Exception as error:
+                if attempt == self.retries or not is_transient(error):
+                    raise
+                metrics.count('smtp_retries')
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(.5, 1.5))
+
+    def send_all(self, digest: bool = False) -> list:
+        """Deliver every queued message. Returns (message, error) pairs for those that could not be delivered."""
+        messages = merge_digests(self.messages) if digest else self.messages
+        self.messages = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.pool.size) as executor:
+            for msg, future in [(msg, executor.submit(self.send, msg)) for msg in messages]:
+                try:
+                    future.result()
+                except Exception as error:
+                    metrics.count('emails_failed')
+                    failed.append((msg, error))
+        return failed
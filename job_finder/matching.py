@@ -0,0 +1,57 @@
+import numpy as np
+
+from .dedup import greedy_unique, normalize
+from .quantize import QuantizedMatrix
+from .records import Subset
+from .sparse import is_sparse
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the <k> highest scores in each row of <scores>, best first.
+
+    Equal scores are ordered by column index, so results are reproducible.
+    """
+    k = min(k, scores.shape[1])
+    if not k:
+        return np.zeros((len(scores), 0), dtype=np.intp)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(scores, candidates, axis=1)
+    order = np.lexsort((candidates, -values), axis=-1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def cosine_scores(profiles: np.ndarray, corpus) -> np.ndarray:
+    """Cosine similarity of every profile vector to every corpus vector, as one matrix product.
+
+    <corpus> may be a QuantizedMatrix, whose rows are already unit length; it is scored without decoding it.
+    Sparse profiles and corpora of term weights give a dense matrix of scores.
+    """
+    if isinstance(corpus, QuantizedMatrix):
+        return corpus.score(normalize(profiles))
+    scores = normalize(profiles) @ normalize(corpus).T
+    return scores.toarray() if is_sparse(scores) else scores
+
+
+def match_profiles(profiles: np.ndarray, corpus: np.ndarray, num_jobs, threshold: float = .99,
+                   texts: list = None) -> list:
+    """Find the corpus rows best matching each of many profile vectors (resumes or ideal job descriptions).
+
+    All profile by listing scores come from a single matrix product. <num_jobs> is the number of listings
+    wanted, either one count for every profile or a list with one count per profile. Twice that many candidates
+    are taken per profile, then near duplicates are dropped as in greedy_unique, using <texts> if given.
+
+    Returns one list of corpus row indices per profile, best match first.
+    """
+    profiles = profiles if is_sparse(profiles) else np.atleast_2d(profiles)
+    if np.isscalar(num_jobs):
+        num_jobs = [num_jobs] * profiles.shape[0]
+    candidates = top_k(cosine_scores(profiles, corpus), 2 * max(num_jobs, default=0))
+    matches = []
+    for row, wanted in zip(candidates, num_jobs):
+        row = row[:2 * wanted]
+        keep = greedy_unique(corpus[row],
+                             threshold=threshold,
+                             limit=wanted,
+                             texts=Subset(texts, row) if texts is not None else None)
+        matches.append([int(row[i]) for i in keep])
+    return matches
@@ -0,0 +1,192 @@
+import bisect
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .startup import timed_import
+
+# Upper bounds, in seconds, of latency histogram buckets.
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30.)
+
+
+class Histogram(object):
+    """Counts of observed values falling under each of <buckets>, plus their sum."""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket is +Inf.
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        return {'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], self.counts)),
+                'sum': self.sum, 'count': self.count}
+
+
+class Metrics(object):
+    """Stage timers, counters and histograms for one process.
+
+    Safe to update from scraper threads. Export with to_dict() or write_json() at the end of a run, or serve
+    Prometheus text from a long running process with serve(). Set <profile_stage> to profile every run of that
+    stage with cProfile, or with pyinstrument when <profiler> is 'pyinstrument'; reports go to <profile_path>, or
+    are printed.
+    """
+
+    def __init__(self, profile_stage: str = None, profiler: str = 'cprofile', profile_path: str = None) -> None:
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.stages = {}  # name -> [total seconds, runs]
+        self.histograms = {}
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.profile_path = profile_path
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS) -> None:
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+            self.histograms[name].observe(value)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Observe the time spent in the block in histogram <name>."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Add the time spent in the block to stage <name>, profiling it if it is <self.profile_stage>."""
+        profiling = name == self.profile_stage
+        profiler = self.start_profiler() if profiling else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profiling:
+                self.stop_profiler(profiler, name)
+            with self.lock:
+                total = self.stages.setdefault(name, [0., 0])
+                total[0] += seconds
+                total[1] += 1
+
+    def start_profiler(self):
+        if self.profiler == 'pyinstrument':
+            profiler = timed_import('pyinstrument').Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def stop_profiler(self, profiler, name: str) -> None:
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(30)
+            report = out.getvalue()
+        else:
+            profiler.stop()
+            report = profiler.output_text()
+        report = f'Profile of stage {name}:\n{report}'
+        if self.profile_path:
+            with open(self.profile_path, 'a') as f:
+                f.write(report)
+        else:
+            print(report)
+
+    def rates(self) -> dict:
+        """Throughputs and ratios derived from the raw counts."""
+        rates = {}
+        lookups = self.counters.get('cache_hits', 0) + self.counters.get('cache_misses', 0)
+        if lookups:
+            rates['cache_hit_rate'] = self.counters.get('cache_hits', 0) / lookups
+        seconds, _ = self.stages.get('vectorize', (0, 0))
+        if seconds:
+            rates['documents_vectorized_per_sec'] = self.counters.get('documents_vectorized', 0) / seconds
+        seconds, _ = self.stages.get('scrape', (0, 0))
+        if seconds:
+            rates['bytes_downloaded_per_sec'] = self.counters.get('bytes_downloaded', 0) / seconds
+        return rates
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {'started': self.started,
+                    'elapsed_seconds': time.time() - self.started,
+                    'stages': {name: {'seconds': seconds, 'runs': runs}
+                               for name, (seconds, runs) in self.stages.items()},
+                    'counters': dict(self.counters),
+                    'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+                    'rates': self.rates()}
+
+    def write_json(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def prometheus(self, prefix: str = 'job_finder') -> str:
+        """Current metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            lines.append(f'# TYPE {prefix}_stage_seconds_total counter')
+            lines += [f'{prefix}_stage_seconds_total{{stage="{name}"}} {seconds}'
+                      for name, (seconds, _) in self.stages.items()]
+            lines.append(f'# TYPE {prefix}_stage_runs_total counter')
+            lines += [f'{prefix}_stage_runs_total{{stage="{name}"}} {runs}' for name, (_, runs) in self.stages.items()]
+            for name, value in self.counters.items():
+                lines.append(f'# TYPE {prefix}_{name}_total counter')
+                lines.append(f'{prefix}_{name}_total {value}')
+            for name, histogram in self.histograms.items():
+                lines.append(f'# TYPE {prefix}_{name} histogram')
+                cumulative = 0
+                for bound, count in zip([str(bound) for bound in histogram.buckets] + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_{name}_sum {histogram.sum}')
+                lines.append(f'{prefix}_{name}_count {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '') -> ThreadingHTTPServer:
+        """Serve Prometheus text at /metrics from a background thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Metrics for this process.
+metrics = Metrics()
@@ -0,0 +1,240 @@
+import importlib.util
+import re
+import time
+
+from html.parser import HTMLParser
+
+from .startup import timed_import
+
+# Elements whose contents are not page text.
+CODE_TAGS = ('script', 'style')
+# Elements that never have a closing tag.
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track',
+             'wbr'}
+
+
+class Element(object):
+    """An element to extract: a tag whose <attr> attribute is <value>, or for class, contains <value>."""
+
+    def __init__(self, tag: str, attr: str, value: str) -> None:
+        self.tag = tag
+        self.attr = attr
+        self.value = value
+
+    def matches(self, tag: str, attrs: dict) -> bool:
+        value = attrs.get(self.attr)
+        if tag != self.tag or value is None:
+            return False
+        if self.attr == 'class':
+            return self.value in value.split()
+        return value == self.value
+
+    def xpath(self) -> str:
+        if self.attr == 'class':
+            return f"{self.tag}[contains(concat(' ', normalize-space(@class), ' '), ' {self.value} ')]"
+        return f"{self.tag}[@{self.attr}='{self.value}']"
+
+    def strainer(self):
+        if self.attr == 'class':
+            return timed_import('bs4').SoupStrainer(self.tag, class_=self.has_class)
+        return timed_import('bs4').SoupStrainer(self.tag, attrs={self.attr: self.value})
+
+    def has_class(self, value) -> bool:
+        if value is None:
+            return False
+        return self.value in (value.split() if isinstance(value, str) else value)
+
+
+# The extraction spec every backend follows.
+# Results pages: the href of each job title link inside a result row.
+RESULT_ROW = Element('div', 'class', 'row')
+RESULT_LINK = Element('a', 'class', 'jobtitle')
+# Description pages: the text of the first element matching each field, or None if there is none.
+# Text is every string inside the element except the contents of CODE_TAGS. Many pages have no pay or posted date.
+DESCRIPTION_FIELDS = {
+    'title': Element('h3', 'class', 'jobsearch-JobInfoHeader-title'),
+    'description': Element('div', 'id', 'jobDescriptionText'),
+    'pay': Element('div', 'class', 'jobsearch-JobMetadataHeader-item'),
+    'posted': Element('div', 'class', 'jobsearch-JobMetadataFooter'),
+}
+
+
+def decode(html) -> str:
+    return html.decode('utf-8', 'replace') if isinstance(html, bytes) else html
+
+
+# lxml: a full C parse, queried with XPath.
+def lxml_links(html) -> list:
+    root = lxml_root(html)
+    if root is None:
+        return []
+    return root.xpath(f'//{RESULT_ROW.xpath()}//{RESULT_LINK.xpath()}/@href')
+
+
+def lxml_fields(html) -> dict:
+    root = lxml_root(html)
+    fields = {}
+    for name, element in DESCRIPTION_FIELDS.items():
+        found = root.xpath(f'//{element.xpath()}') if root is not None else []
+        if found:
+            for code in found[0].xpath('|'.join(f'.//{tag}' for tag in CODE_TAGS)):
+                code.drop_tree()
+        fields[name] = found[0].text_content() if found else None
+    return fields
+
+
+def lxml_root(html):
+    # Bytes, read as UTF-8 like the other backends: lxml refuses str pages that declare their own encoding.
+    data = html.encode('utf-8') if isinstance(html, str) else html
+    if not data.strip():
+        return None
+    lxml_html = timed_import('lxml.html')
+    try:
+        return lxml_html.fromstring(data, parser=lxml_html.HTMLParser(encoding='utf-8'))
+    except timed_import('lxml.etree').ParserError:  # No elements at all, like a page of only a comment.
+        return None
+
+
+# BeautifulSoup: html.parser, building only the elements the spec names.
+def soup_links(html) -> list:
+    soup = timed_import('bs4').BeautifulSoup(decode(html), 'html.parser', parse_only=RESULT_ROW.strainer())
+    return [a['href'] for row in soup.find_all(RESULT_ROW.tag, class_=RESULT_ROW.has_class)
+            for a in row.find_all(RESULT_LINK.tag, class_=RESULT_LINK.has_class)]
+
+
+def soup_fields(html) -> dict:
+    # One parse keeping every tag the spec names, rather than one parse per field.
+    bs4 = timed_import('bs4')
+    tags = sorted({element.tag for element in DESCRIPTION_FIELDS.values()})
+    soup = bs4.BeautifulSoup(decode(html), 'html.parser', parse_only=bs4.SoupStrainer(tags))
+    fields = {}
+    for name, element in DESCRIPTION_FIELDS.items():
+        if element.attr == 'class':
+            found = soup.find(element.tag, class_=element.has_class)
+        else:
+            found = soup.find(element.tag, attrs={element.attr: element.value})
+        if found:
+            for code in found.find_all(CODE_TAGS):
+                code.decompose()
+        fields[name] = found.text if found else None
+    return fields
+
+
+# Streaming: a single pass of the standard library tokenizer, no tree at all.
+class Capture(object):
+    """Text collected from an open element, with the stack of tags open inside it."""
+
+    def __init__(self, tag: str) -> None:
+        self.stack = [tag]
+        self.parts = []
+
+    def close(self, tag: str) -> bool:
+        """Close <tag>, and any unclosed tags inside it. True once the captured element itself is closed."""
+        if tag in self.stack:
+            del self.stack[len(self.stack) - 1 - self.stack[::-1].index(tag):]
+        return not self.stack
+
+
+class StreamExtractor(HTMLParser):
+    """Collect the spec's links and field text while tokenizing, without building a tree."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.links = []
+        self.fields = dict.fromkeys(DESCRIPTION_FIELDS)
+        self.captures = {}  # field name -> Capture
+        self.row = None  # Capture of the result row we are inside, if any.
+        self.code = False  # Inside one of CODE_TAGS.
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        attrs = dict(attrs)
+        self.code = tag in CODE_TAGS
+        if tag not in VOID_TAGS:
+            for capture in self.captures.values():
+                capture.stack.append(tag)
+            if self.row:
+                self.row.stack.append(tag)
+        if self.row is None and RESULT_ROW.matches(tag, attrs):
+            self.row = Capture(tag)
+        elif self.row and RESULT_LINK.matches(tag, attrs) and attrs.get('href') is not None:
+            self.links.append(attrs['href'])
+        for name, element in DESCRIPTION_FIELDS.items():
+            if self.fields[name] is None and name not in self.captures and element.matches(tag, attrs):
+                self.captures[name] = Capture(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in VOID_TAGS:
+            return
+        self.code = False
+        if self.row and self.row.close(tag):
+            self.row = None
+        for name, capture in list(self.captures.items()):
+            if capture.close(tag):
+                self.fields[name] = ''.join(capture.parts)
+                del self.captures[name]
+
+    def handle_data(self, data: str) -> None:
+        if self.code:
+            return
+        for capture in self.captures.values():
+            capture.parts.append(data)
+
+    def close(self) -> None:
+        super().close()
+        # Elements left open at the end of the document run to its end.
+        for name, capture in self.captures.items():
+            self.fields[name] = ''.join(capture.parts)
+        self.captures = {}
+
+
+def stream_extract(html) -> StreamExtractor:
+    extractor = StreamExtractor()
+    extractor.feed(decode(html))
+    extractor.close()
+    return extractor
+
+
+def stream_links(html) -> list:
+    return stream_extract(html).links
+
+
+def stream_fields(html) -> dict:
+    return stream_extract(html).fields
+
+
+BACKENDS = {
+    'lxml': (lxml_links, lxml_fields),
+    'soup': (soup_links, soup_fields),
+    'stream': (stream_links, stream_fields),
+}
+
+
+def default_backend() -> str:
+    """lxml if it is installed, otherwise BeautifulSoup."""
+    return 'lxml' if importlib.util.find_spec('lxml') else 'soup'
+
+
+def parse_links(html, backend: str = 'soup') -> list:
+    """Hrefs of the job listing links on a search results page, in page order."""
+    return BACKENDS[backend][0](html)
+
+
+def parse_fields(html, backend: str = 'soup') -> dict:
+    """Text of each of DESCRIPTION_FIELDS on a job description page; None for fields the page lacks."""
+    return BACKENDS[backend][1](html)
+
+
+def posted_time(text: str, now: float = None):
+    """The time a listing was posted, from a description page's "posted" text such as "3 days ago" or "30+ days
+    ago", as seconds since the epoch; None if <text> gives no age.
+    """
+    if not text:
+        return None
+    now = time.time() if now is None else now
+    if re.search(r'just posted|today', text, re.IGNORECASE):
+        return now
+    found = re.search(r'(\d+)\+?\s*(hour|day)s?\s+ago', text, re.IGNORECASE)
+    if found is None:
+        return None
+    unit = 60 * 60 if found.group(2).lower() == 'hour' else 24 * 60 * 60
+    return now - int(found.group(1)) * unit
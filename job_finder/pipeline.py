@@ -0,0 +1,63 @@
+import heapq
+import numpy as np
+
+from itertools import count, islice
+
+from .dedup import normalize
+
+
+def batches(iterable, size: int):
+    """Yield lists of up to <size> consecutive items from <iterable>."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class TopK(object):
+    """Fixed size min-heap holding the <k> highest scoring items pushed so far.
+
+    Ties keep the item pushed first, so rankings match a stable sort of the whole stream.
+    """
+
+    def __init__(self, k: int) -> None:
+        self.k = k
+        self.heap = []
+        self.counter = count()
+
+    def push(self, score: float, item) -> None:
+        # Negated counter: among equal scores, later pushes rank lower and are evicted first.
+        entry = (score, -next(self.counter), item)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif entry[:2] > self.heap[0][:2]:
+            heapq.heapreplace(self.heap, entry)
+
+    def items(self) -> list:
+        """Items best first."""
+        return [item for _, _, item in sorted(self.heap, key=lambda entry: entry[:2], reverse=True)]
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+
+def rank_stream(listings, embed, query: np.ndarray, k: int, batch_size: int = 64):
+    """Rank (url, description, title) listings against <query> as they arrive.
+
+    Listings are vectorized by <embed> in batches of <batch_size> and scored by cosine similarity to <query>;
+    only the <k> most similar are held, each with its vector. Yields the provisional ranking, best first, as a list of
+    (listing, vector) pairs after every batch, so memory stays flat however many listings stream through.
+    <query> may instead be a function returning the vector, called once the first batch has arrived, so whatever it
+    waits on, like a model loading, overlaps the fetching of <listings>.
+    """
+    top = TopK(k)
+    unit = None
+    for batch in batches(listings, batch_size):
+        matrix = embed([description for _, description, _ in batch])
+        if unit is None:
+            unit = normalize(np.reshape(query() if callable(query) else query, (1, -1)))[0]
+        for listing, vector, score in zip(batch, matrix, normalize(matrix) @ unit):
+            top.push(float(score), (listing, np.array(vector)))
+        yield top.items()
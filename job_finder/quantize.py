@@ -0,0 +1,249 @@
+import numpy as np
+import os
+
+from .dedup import normalize
+
+# Rows scored or decoded at a time, bounding the float32 scratch memory of a quantized matrix.
+CHUNK_ROWS = 4096
+# Rows a codebook is learned from. A codebook learned from this many is saved and reused for later matrices.
+SAMPLE_ROWS = 10240
+
+
+def sample_rows(n: int, seed: int = 0) -> np.ndarray:
+    """Sorted indices of up to SAMPLE_ROWS of <n> rows, chosen at random."""
+    return np.sort(np.random.RandomState(seed).choice(n, min(n, SAMPLE_ROWS), replace=False))
+
+
+def unit_chunks(matrix: np.ndarray):
+    """Yield (start, stop, rows) for each CHUNK_ROWS slice of <matrix>, its rows scaled to unit length.
+
+    Only one normalized chunk exists at a time, so <matrix>, which may be memory mapped, is never copied whole.
+    """
+    for start in range(0, len(matrix), CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, len(matrix))
+        yield start, stop, normalize(matrix[start:stop])
+
+
+class QuantizedMatrix(object):
+    """A compressed matrix of unit row vectors, built from the rows of a float32 matrix normalized chunk by chunk.
+
+    Indexing decodes rows back to float32, for the few rows dedup compares. score() gives the dot products of
+    float32 queries with every row without decoding the matrix: asymmetric distance, since only the corpus side
+    is quantized.
+    The arrays named in <codebook_fields> are learned from a sample of rows; passing a saved <codebook> skips that.
+    """
+
+    codebook_fields = ()
+
+    def __init__(self, shape: tuple) -> None:
+        self.shape = shape
+        self.trained_on = 0  # Rows the codebook was learned from, 0 when it was given.
+
+    @classmethod
+    def bytes_for(cls, shape: tuple) -> int:
+        """Size of a matrix of <shape> compressed this way."""
+        raise NotImplementedError
+
+    @property
+    def codebook(self) -> dict:
+        return {name: getattr(self, name) for name in self.codebook_fields}
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, rows) -> np.ndarray:
+        return self.decode(np.arange(self.shape[0])[rows])
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def score_chunk(self, start: int, stop: int, queries: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def score(self, queries: np.ndarray) -> np.ndarray:
+        """Dot products of each of <queries> with every row, one row of scores per query."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        scores = np.empty((len(queries), self.shape[0]), dtype=np.float32)
+        for start in range(0, self.shape[0], CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, self.shape[0])
+            scores[:, start:stop] = self.score_chunk(start, stop, queries)
+        return scores
+
+    @property
+    def nbytes(self) -> int:
+        raise NotImplementedError
+
+
+class Float16Matrix(QuantizedMatrix):
+    """Half precision rows: 2x smaller, and near lossless for unit vectors."""
+
+    def __init__(self, matrix: np.ndarray, codebook: dict = None) -> None:
+        super().__init__(matrix.shape)
+        self.codes = np.empty(matrix.shape, dtype=np.float16)
+        for start, stop, unit in unit_chunks(matrix):
+            self.codes[start:stop] = unit
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        return self.codes[rows].astype(np.float32)
+
+    def score_chunk(self, start: int, stop: int, queries: np.ndarray) -> np.ndarray:
+        return queries @ self.codes[start:stop].astype(np.float32).T
+
+    @classmethod
+    def bytes_for(cls, shape: tuple) -> int:
+        return shape[0] * shape[1] * 2
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+
+class Int8Matrix(QuantizedMatrix):
+    """One byte per value, scaled per dimension between that dimension's minimum and maximum: 4x smaller.
+
+    The range of each dimension is learned from a sample of rows; values outside it are clipped.
+    """
+
+    codebook_fields = ('offset', 'scale')
+
+    def __init__(self, matrix: np.ndarray, codebook: dict = None, seed: int = 0) -> None:
+        super().__init__(matrix.shape)
+        if codebook is None:
+            rows = sample_rows(len(matrix), seed=seed)
+            training = normalize(matrix[rows]) if len(rows) else np.zeros((1, matrix.shape[1]), dtype=np.float32)
+            self.offset = training.min(axis=0)
+            self.scale = np.maximum(training.max(axis=0) - self.offset, 1e-12).astype(np.float32) / 255
+            self.trained_on = len(rows)
+        else:
+            self.offset, self.scale = codebook['offset'], codebook['scale']
+        self.codes = np.empty(matrix.shape, dtype=np.uint8)
+        for start, stop, unit in unit_chunks(matrix):
+            self.codes[start:stop] = np.clip(np.rint((unit - self.offset) / self.scale), 0, 255)
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        return self.codes[rows] * self.scale + self.offset
+
+    def score_chunk(self, start: int, stop: int, queries: np.ndarray) -> np.ndarray:
+        # (codes * scale + offset) . q == codes . (scale * q) + offset . q
+        return (queries * self.scale) @ self.codes[start:stop].T.astype(np.float32) + \
+            (queries @ self.offset)[:, np.newaxis]
+
+    @classmethod
+    def bytes_for(cls, shape: tuple) -> int:
+        return shape[0] * shape[1] + 2 * shape[1] * 4
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scale.nbytes + self.offset.nbytes
+
+
+def euclidean_kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """<k> centroids of <vectors> by Lloyd's algorithm, in Euclidean distance."""
+    generator = np.random.RandomState(seed)
+    centroids = vectors[generator.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (vectors ** 2).sum(axis=1)[:, np.newaxis] - 2 * vectors @ centroids.T + \
+            (centroids ** 2).sum(axis=1)
+        assign = np.argmin(distances, axis=1)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.stack([np.bincount(assign, weights=column, minlength=k) for column in vectors.T], axis=1)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+    return centroids
+
+
+class PQMatrix(QuantizedMatrix):
+    """Product quantization: each row is split into <subspaces> slices, and each slice is stored as the one byte
+    id of its nearest of 256 centroids learned for that slice. The default, one subspace per two dimensions, is
+    8x smaller than float32; one per four dimensions is 16x smaller but ranks noticeably less like float32.
+
+    Scoring builds a table of each query slice's dot product with every centroid, then sums table lookups.
+    """
+
+    codebook_fields = ('centroids',)
+
+    def __init__(self, matrix: np.ndarray, subspaces: int = None, codebook: dict = None, seed: int = 0) -> None:
+        super().__init__(matrix.shape)
+        if codebook is None:
+            self.subspaces, self.sub_width = self.layout(matrix.shape[1], subspaces)
+            rows = sample_rows(len(matrix), seed=seed)
+            training = self.pad(normalize(matrix[rows]))
+            k = min(256, len(training)) or 1
+            self.centroids = np.zeros((self.subspaces, k, self.sub_width), dtype=np.float32)
+            for j in range(self.subspaces):
+                if len(training):
+                    self.centroids[j] = euclidean_kmeans(training[:, j * self.sub_width:(j + 1) * self.sub_width],
+                                                         k, seed=seed + j)
+            self.trained_on = len(rows)
+        else:
+            self.centroids = codebook['centroids']
+            self.subspaces, _, self.sub_width = self.centroids.shape
+        self.codes = np.zeros((len(matrix), self.subspaces), dtype=np.uint8)
+        for start, stop, unit in unit_chunks(matrix):
+            padded = self.pad(unit)
+            for j in range(self.subspaces):
+                chunk = padded[:, j * self.sub_width:(j + 1) * self.sub_width]
+                distances = -2 * chunk @ self.centroids[j].T + (self.centroids[j] ** 2).sum(axis=1)
+                self.codes[start:stop, j] = np.argmin(distances, axis=1)
+
+    @staticmethod
+    def layout(width: int, subspaces: int = None) -> tuple:
+        """Number and width of the slices rows of <width> are split into."""
+        subspaces = subspaces or max((width + 1) // 2, 1)
+        return subspaces, -(-width // subspaces)
+
+    @classmethod
+    def bytes_for(cls, shape: tuple) -> int:
+        subspaces, sub_width = cls.layout(shape[1])
+        return shape[0] * subspaces + subspaces * min(256, shape[0]) * sub_width * 4
+
+    def pad(self, matrix: np.ndarray) -> np.ndarray:
+        padding = self.subspaces * self.sub_width - matrix.shape[1]
+        return np.pad(matrix, ((0, 0), (0, padding)), mode='constant') if padding else matrix
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        codes = self.codes[rows]
+        parts = [self.centroids[j][codes[..., j]] for j in range(self.subspaces)]
+        return np.concatenate(parts, axis=-1)[..., :self.shape[1]]
+
+    def score_chunk(self, start: int, stop: int, queries: np.ndarray) -> np.ndarray:
+        slices = self.pad(queries).reshape(len(queries), self.subspaces, self.sub_width)
+        tables = np.einsum('qjd,jkd->qjk', slices, self.centroids)  # query, subspace, centroid
+        codes = self.codes[start:stop]
+        scores = np.zeros((len(queries), stop - start), dtype=np.float32)
+        for j in range(self.subspaces):
+            scores += tables[:, j, codes[:, j]]
+        return scores
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.centroids.nbytes
+
+
+QUANTIZERS = {'float16': Float16Matrix, 'int8': Int8Matrix, 'pq': PQMatrix}
+
+
+def quantize(matrix, mode: str, codebook_path: str = None):
+    """Compress the normalized rows of <matrix> with one of QUANTIZERS, one chunk of rows at a time.
+
+    <matrix> need only support len() and indexing by row slices and arrays, so it may be a view of stored rows
+    that are read a chunk at a time. With <codebook_path>, a codebook saved there for rows of the same width is
+    reused; otherwise one is learned, and saved there if it was learned from a full sample.
+    Returns <matrix> as a float32 array instead when compressing it would not make it smaller.
+    """
+    quantizer = QUANTIZERS[mode]
+    if quantizer.bytes_for(matrix.shape) >= matrix.shape[0] * matrix.shape[1] * 4:
+        return np.asarray(matrix[:], dtype=np.float32)
+    codebook = None
+    if codebook_path and quantizer.codebook_fields and os.path.exists(codebook_path):
+        with np.load(codebook_path) as data:
+            if int(data['width']) == matrix.shape[1]:  # Otherwise saved for another model.
+                codebook = {name: data[name] for name in quantizer.codebook_fields}
+    quantized = quantizer(matrix, codebook=codebook)
+    if codebook_path and quantized.codebook and quantized.trained_on >= SAMPLE_ROWS:
+        temp_path = codebook_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, width=matrix.shape[1], **quantized.codebook)
+        os.replace(temp_path, codebook_path)
+    return quantized
+
@@ -0,0 +1,107 @@
+import sys
+import tempfile
+import threading
+import zlib
+
+from collections.abc import Sequence
+
+
+class TextSpool(object):
+    """Compressed texts appended to one temporary file, which stays in memory until it outgrows <max_memory> bytes.
+
+    Safe to add to from scraper threads.
+    """
+
+    def __init__(self, max_memory: int = 16 * 1024 * 1024) -> None:
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def put(self, text: str) -> tuple:
+        """Store <text>; returns the (offset, length) to read it back with."""
+        data = zlib.compress(text.encode('utf-8'))
+        with self.lock:
+            offset = self.size
+            self.file.seek(offset)
+            self.file.write(data)
+            self.size += len(data)
+        return offset, len(data)
+
+    def get(self, offset: int, length: int) -> str:
+        with self.lock:
+            self.file.seek(offset)
+            data = self.file.read(length)
+        return zlib.decompress(data).decode('utf-8')
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class Listing(object):
+    """A scraped job listing whose description lives in a TextSpool until it is read.
+
+    Behaves like the (url, description, title) tuple it replaces: it can be indexed and unpacked, though only
+    reading the description touches the spool. Urls and titles are interned, since both repeat across pages and
+    runs.
+    """
+
+    __slots__ = ('url', 'title', 'spool', 'offset', 'length')
+
+    def __init__(self, url: str, description: str, title: str, spool: TextSpool) -> None:
+        self.url = sys.intern(url)
+        self.title = sys.intern(title)
+        self.spool = spool
+        self.offset, self.length = spool.put(description)
+
+    @property
+    def description(self) -> str:
+        return self.spool.get(self.offset, self.length)
+
+    def __getitem__(self, i):
+        if i in (0, -3):
+            return self.url
+        if i in (1, -2):
+            return self.description
+        if i in (2, -1):
+            return self.title
+        return tuple(self)[i]  # Slices, or an IndexError.
+
+    def __iter__(self):
+        return iter((self.url, self.description, self.title))
+
+    def __len__(self) -> int:
+        return 3
+
+    def __repr__(self) -> str:
+        return f'Listing({self.url!r}, <{self.length} bytes>, {self.title!r})'
+
+
+class Descriptions(Sequence):
+    """Read only view of the descriptions of (url, description, title) <listings>, each read only when used."""
+
+    def __init__(self, listings: list) -> None:
+        self.listings = listings
+
+    def __len__(self) -> int:
+        return len(self.listings)
+
+    def __getitem__(self, i) -> str:
+        if isinstance(i, slice):
+            return Descriptions(self.listings[i])
+        return self.listings[i][1]
+
+
+class Subset(Sequence):
+    """Read only view of <items> at <indices>."""
+
+    def __init__(self, items: Sequence, indices: list) -> None:
+        self.items = items
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return Subset(self.items, self.indices[i])
+        return self.items[self.indices[i]]
@@ -0,0 +1,49 @@
+import hashlib
+import numpy as np
+import os
+
+
+def key_hash(key: str) -> int:
+    """64 bit hash of <key>."""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class SeenIndex(object):
+    """Persistent set of keys, such as jobkeys, stored as a sorted array of 64 bit hashes.
+
+    Eight bytes per key on disc and in memory, with binary search lookups. False positives need two keys to
+    share a 64 bit hash, which is negligible at the sizes a job search reaches.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.hashes = np.load(path) if os.path.exists(path) else np.zeros(0, dtype=np.uint64)
+        self.pending = set()
+
+    def __contains__(self, key: str) -> bool:
+        value = key_hash(key)
+        i = np.searchsorted(self.hashes, np.uint64(value))
+        return (i < len(self.hashes) and int(self.hashes[i]) == value) or value in self.pending
+
+    def __len__(self) -> int:
+        return len(self.hashes) + len(self.pending)
+
+    def add(self, key: str) -> None:
+        if key not in self:
+            self.pending.add(key_hash(key))
+
+    def update(self, keys) -> None:
+        for key in keys:
+            self.add(key)
+
+    def save(self) -> None:
+        """Merge added keys into the sorted array and write it to disc."""
+        if self.pending:
+            self.hashes = np.union1d(self.hashes, np.fromiter(self.pending, dtype=np.uint64, count=len(self.pending)))
+            self.pending = set()
+        temp_path = self.path + '.tmp.npy'
+        np.save(temp_path, self.hashes)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import time
+import urllib3
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import ListingCache, ListingFilter, job_key
+from .job_finder import (CACHE_DIR, LISTING_CACHE_SIZE, LISTING_MAX_AGE, LISTING_TTL, MAIL_RATE, MAIL_RETRIES,
+                         METRICS_PATH, PROFILE_STAGE, PROFILER, REQUEST_RATE, REQUEST_RETRIES, SMTP_CONNECTIONS,
+                         VECTOR_MAX_AGE, IndeedScraper, JobFinder)
+from .mail import MailQueue, SMTPPool
+from .metrics import metrics
+from .seen import SeenIndex
+from .startup import timed_import
+from .throttle import RequestScheduler
+from .vectors import VectorStore, model_name
+
+
+class SavedSearch(object):
+    """A search to run on a schedule and email to <email>.
+
+    <document> is the path of the resume or ideal job description to match against; <cadence> is the number of
+    minutes between runs. <keywords>, <exclude> and <location> filter the listings ranked, as in ListingFilter.
+    """
+
+    def __init__(self, name: str, document: str, email: str, city: str = '', state: str = '', terms: str = '',
+                 pages: int = 1, num_jobs: int = 10, cadence: float = 24 * 60, keywords: str = '', exclude: str = '',
+                 location: str = '') -> None:
+        self.name = name
+        self.document = document
+        self.email = email
+        self.city = city.strip().title()
+        self.state = state.strip().upper()
+        self.terms = terms.strip().lower()
+        self.pages = pages
+        self.num_jobs = num_jobs
+        self.cadence = cadence
+        self.listing_filter = ListingFilter(keywords, exclude, location)
+
+    @property
+    def query(self) -> tuple:
+        """Searches with the same query share one scrape."""
+        return self.city, self.state, self.terms
+
+    def load_document(self) -> str:
+        with open(self.document, 'r') as f:
+            return f.read().strip('\n')
+
+
+class SearchService(object):
+    """Run saved searches on a schedule from one long running process.
+
+    The Spacy model, vector store and listing cache are loaded once and shared by every search. Each cycle, due
+    searches with the same city, state and terms share a single scrape, and scrapes run concurrently under one
+    request scheduler, so together they stay within each host's rate limit. Each search is emailed only the
+    listings it has not been sent on a previous run. Messages are sent together at the end of
+    the cycle over pooled SMTP connections; with "digest" set, a recipient of several searches gets one message.
+
+    The config file is JSON:
+        {"model": "en_core_web_sm", "digest": false,
+         "searches": [{"name": "...", "document": "Resume.txt", "email": "...", "city": "...", "state": "...",
+                       "terms": "...", "pages": 5, "num_jobs": 10, "cadence": 1440,
+                       "keywords": "python, sql", "exclude": "senior", "location": ""}]}
+    """
+
+    def __init__(self, config_path: str, state_dir: str = CACHE_DIR, max_scrapes: int = 4,
+                 metrics_path: str = None) -> None:
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+        self.searches = [SavedSearch(**search) for search in config['searches']]
+        self.max_scrapes = max_scrapes
+        self.metrics_path = metrics_path
+        print('\nLoading NLP packages...')
+        self.nlp = timed_import('spacy').load(config.get('model', 'en_core_web_sm'))
+        self.vector_store = VectorStore(os.path.join(state_dir, 'vectors'), model_name(self.nlp),
+                                        max_age=VECTOR_MAX_AGE)
+        self.listing_cache = ListingCache(os.path.join(state_dir, 'listings.sqlite3'),
+                                          ttl=LISTING_TTL,
+                                          max_entries=LISTING_CACHE_SIZE,
+                                          max_age=LISTING_MAX_AGE)
+        self.scheduler = RequestScheduler(urllib3.PoolManager(maxsize=8, block=True),
+                                          rate=REQUEST_RATE, retries=REQUEST_RETRIES)
+        self.seen = SeenIndex(os.path.join(state_dir, 'sent.npy'))
+        self.digest = config.get('digest', False)
+        self.smtp_pool = SMTPPool(JobFinder.initialize_server, size=SMTP_CONNECTIONS)
+        self.mail_queue = MailQueue(self.smtp_pool, per_minute=MAIL_RATE, retries=MAIL_RETRIES)
+        self.state_path = os.path.join(state_dir, 'service.json')
+        self.last_run = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                self.last_run = json.load(f)
+
+    def due(self, now: float) -> list:
+        """Saved searches whose cadence has elapsed since their last run."""
+        return [search for search in self.searches
+                if now - self.last_run.get(search.name, 0) >= search.cadence * 60]
+
+    def scrape(self, searches: list) -> dict:
+        """Scrape each distinct query among <searches> concurrently, for the most pages any of them asks for."""
+        pages = {}
+        for search in searches:
+            pages[search.query] = max(pages.get(search.query, 0), search.pages)
+        scrapers = {query: IndeedScraper(num_pages, 0, *query, cache=self.listing_cache,
+                                         scheduler=self.scheduler)
+                    for query, num_pages in pages.items()}
+        with metrics.stage('scrape'), ThreadPoolExecutor(max_workers=self.max_scrapes) as executor:
+            futures = {query: executor.submit(scraper.get_descriptions) for query, scraper in scrapers.items()}
+            return {query: future.result() for query, future in futures.items()}
+
+    @staticmethod
+    def sent_key(search: SavedSearch, url: str) -> str:
+        """Key recording that the listing at <url> was sent to <search>."""
+        return f'{search.name}\0{job_key(url)}'
+
+    def run_search(self, search: SavedSearch, descriptions: list) -> list:
+        """Rank <descriptions> for <search> and queue an email of the listings it has not been sent before.
+        Returns the sent keys to record once the email is delivered."""
+        new = [description for description in descriptions if self.sent_key(search, description[0]) not in self.seen]
+        print(f'\n{search.name}: {len(new)} new of {len(descriptions)} listings.')
+        if not new:
+            return []
+        finder = JobFinder(search.pages, search.num_jobs, search.load_document(), search.email,
+                           search.city, search.state, search.terms,
+                           nlp=self.nlp, vector_store=self.vector_store, listing_cache=self.listing_cache,
+                           mail_queue=self.mail_queue, listing_filter=search.listing_filter)
+        finder.subject = f'New jobs!! {search.name}'
+        finder.rank_descriptions(new)
+        finder.remove_duplicates()
+        finder.email_jobs()
+        return [self.sent_key(search, job[0]) for job in finder.jobs]
+
+    def run_once(self) -> None:
+        """Run every due search, then send their emails."""
+        now = time.time()
+        due = self.due(now)
+        if not due:
+            return
+        scraped = self.scrape(due)
+        ran = []
+        for search in due:
+            try:
+                ran.append((search, self.run_search(search, scraped[search.query])))
+            except Exception as error:  # One failing search must not stop the others.
+                print(f'\n{search.name} failed: {error!r}')
+                metrics.count('searches_failed')
+        with metrics.stage('smtp'):
+            failed = self.mail_queue.send_all(digest=self.digest)
+        undelivered = {str(msg['to']) for msg, _ in failed}
+        for msg, error in failed:
+            print(f'\nEmail to {msg["to"]} failed: {error!r}')
+        for search, sent_keys in ran:
+            if sent_keys and search.email in undelivered:  # Run it again next cycle.
+                metrics.count('searches_failed')
+                continue
+            self.seen.update(sent_keys)
+            metrics.count('searches_run')
+            self.last_run[search.name] = now
+        self.listing_cache.evict()
+        self.seen.save()
+        with open(self.state_path, 'w') as f:
+            json.dump(self.last_run, f)
+        if self.metrics_path:
+            metrics.write_json(self.metrics_path)
+
+    def serve_forever(self, poll: float = 60) -> None:
+        """Check for due searches every <poll> seconds."""
+        while True:
+            self.run_once()
+            time.sleep(poll)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run saved job searches on a schedule.')
+    parser.add_argument('config', help='JSON file of saved searches.')
+    parser.add_argument('--once', action='store_true', help='Run due searches once and exit.')
+    parser.add_argument('--poll', type=float, default=60, help='Seconds between checks for due searches.')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port.')
+    parser.add_argument('--metrics', default=METRICS_PATH, help='Write metrics here as JSON after every cycle.')
+    parser.add_argument('--profile-stage', default=PROFILE_STAGE, help='Profile one stage of every run.')
+    args = parser.parse_args()
+    metrics.profile_stage = args.profile_stage
+    metrics.profiler = PROFILER
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    service = SearchService(args.config, metrics_path=args.metrics)
+    if args.once:
+        service.run_once()
+    else:
+        service.serve_forever(args.poll)
@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from .metrics import metrics
+from .startup import timed_import
+
+
+class BitlyProvider(object):
+    """Shorten urls with Bitly, through pyshorteners."""
+
+    def __init__(self, api_key: str, timeout: float = 5.) -> None:
+        self.shortener = timed_import('pyshorteners').Shortener(api_key=api_key, timeout=timeout)
+
+    def short(self, url: str) -> str:
+        return self.shortener.bitly.short(url)
+
+
+class StubProvider(object):
+    """Offline provider returning made up short urls, for tests and benchmarks."""
+
+    def __init__(self, delay: float = 0.) -> None:
+        self.delay = delay
+
+    def short(self, url: str) -> str:
+        time.sleep(self.delay)
+        return 'https://bit.ly/' + format(zlib.crc32(url.encode('utf-8')), 'x')
+
+
+class NullProvider(object):
+    """Leave urls as they are."""
+
+    @staticmethod
+    def short(url: str) -> str:
+        return url
+
+
+PROVIDERS = {'bitly': BitlyProvider, 'stub': StubProvider, 'none': NullProvider}
+
+
+def make_provider(name: str, api_key: str = None):
+    """The shortening provider called <name>; one of PROVIDERS."""
+    if name == 'bitly':
+        return BitlyProvider(api_key)
+    return PROVIDERS[name]()
+
+
+class UrlShortener(object):
+    """Shorten urls concurrently, remembering every short url on disc.
+
+    submit() starts shortening in the background so it can overlap other work; shorten() collects the results.
+    Urls the provider fails on, or doesn't shorten within <timeout> seconds, are left long rather than holding
+    up or failing the email.
+    """
+
+    def __init__(self, provider, cache_path: str, timeout: float = 5., max_workers: int = 8) -> None:
+        self.provider = provider
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = {}  # url -> future
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(cache_path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS short_urls (url TEXT PRIMARY KEY, short TEXT)')
+        self.db.commit()
+
+    def cached(self, url: str):
+        with self.lock:
+            row = self.db.execute('SELECT short FROM short_urls WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    def fetch(self, url: str) -> str:
+        """Shorten <url> with the provider and remember the result."""
+        with metrics.timer('shorten_seconds'):
+            short = self.provider.short(url)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO short_urls VALUES (?, ?)', (url, short))
+            self.db.commit()
+        return short
+
+    def submit(self, urls: list) -> None:
+        """Start shortening any of <urls> not already cached or in progress."""
+        for url in urls:
+            if url not in self.pending and self.cached(url) is None:
+                self.pending[url] = self.executor.submit(self.fetch, url)
+
+    def shorten(self, urls: list) -> dict:
+        """Map each of <urls> to its short url, or to itself if it could not be shortened in time."""
+        self.submit(urls)
+        deadline = time.perf_counter() + self.timeout
+        short_urls = {}
+        for url in urls:
+            future = self.pending.pop(url, None)
+            if future is None:
+                short_urls[url] = self.cached(url) or url
+                metrics.count('shorten_cache_hits')
+                continue
+            try:
+                short_urls[url] = future.result(timeout=max(deadline - time.perf_counter(), 0))
+            except TimeoutError:
+                short_urls[url] = url
+                metrics.count('shorten_timeouts')
+            except Exception:  # Any provider failure: fall back to the long url.
+                short_urls[url] = url
+                metrics.count('shorten_failures')
+        return short_urls
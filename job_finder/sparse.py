@@ -0,0 +1,80 @@
+import numpy as np
+import sys
+
+from .metrics import metrics
+from .startup import timed_import
+
+# Ranking engines that score hashed term weights instead of Spacy vectors; hybrid re-scores their best with Spacy.
+SPARSE_ENGINES = ('tfidf', 'bm25', 'hybrid')
+
+
+class SparseRanker(object):
+    """Rank documents by hashed TF-IDF or BM25 term weights, held in SciPy sparse matrices.
+
+    Terms are hashed into <n_features> columns, so there is no vocabulary to build or store. fit() weights a
+    corpus, learning its document frequencies; score() weights queries against it.
+    With <scheme> 'tfidf', documents and queries are sublinear TF-IDF vectors of unit length, and scores are
+    cosine similarities. With 'bm25', documents carry BM25 term weights (saturated by <k1>, length normalized by
+    <b>) and a query scores the sum of the weights of its terms.
+    """
+
+    def __init__(self, scheme: str = 'tfidf', n_features: int = 2 ** 18, k1: float = 1.2, b: float = .75) -> None:
+        self.scheme = scheme
+        self.k1 = k1
+        self.b = b
+        self.hasher = timed_import('sklearn.feature_extraction.text').HashingVectorizer(
+            n_features=n_features, alternate_sign=False, norm=None, dtype=np.float32)
+        self.idf = None
+
+    def counts(self, texts) -> 'scipy.sparse.csr_matrix':
+        if not len(texts):  # The hasher can't transform nothing.
+            return timed_import('scipy.sparse').csr_matrix((0, self.hasher.n_features), dtype=np.float32)
+        return self.hasher.transform(texts).tocsr()
+
+    def fit(self, texts) -> 'scipy.sparse.csr_matrix':
+        """Weighted term matrix of <texts>, one row per text."""
+        sparse = timed_import('scipy.sparse')
+        counts = self.counts(texts)
+        n = counts.shape[0]
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+        if self.scheme == 'bm25':
+            self.idf = np.log1p((n - df + .5) / (df + .5)).astype(np.float32)
+            lengths = np.asarray(counts.sum(axis=1)).ravel()
+            norms = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1.)) if n else lengths
+            tf = counts.data
+            # Per entry length normalization: repeat each row's norm for each of its stored terms.
+            counts.data = tf * (self.k1 + 1) / (tf + np.repeat(norms, np.diff(counts.indptr)))
+            matrix = counts @ sparse.diags(self.idf)
+        else:
+            self.idf = (np.log((n + 1) / (df + 1)) + 1).astype(np.float32)
+            matrix = self.tfidf(counts)
+        metrics.count('documents_vectorized', n)
+        return matrix.tocsr()
+
+    def tfidf(self, counts: 'scipy.sparse.csr_matrix') -> 'scipy.sparse.csr_matrix':
+        counts.data = 1 + np.log(counts.data)
+        return row_normalize(counts @ timed_import('scipy.sparse').diags(self.idf))
+
+    def transform_queries(self, texts) -> 'scipy.sparse.csr_matrix':
+        counts = self.counts(texts)
+        if self.scheme == 'bm25':
+            counts.data = np.ones_like(counts.data)
+            return counts
+        return self.tfidf(counts)
+
+    def score(self, queries: list, matrix: 'scipy.sparse.csr_matrix') -> np.ndarray:
+        """Scores of each of the <queries> texts against each row of <matrix>, as returned by fit()."""
+        return (self.transform_queries(queries) @ matrix.T).toarray()
+
+
+def row_normalize(matrix: 'scipy.sparse.spmatrix') -> 'scipy.sparse.csr_matrix':
+    """Scale each row of a sparse <matrix> to unit length. All zero rows are left as zeros."""
+    sparse = timed_import('scipy.sparse')
+    matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    return sparse.diags(np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0)) @ matrix
+
+
+def is_sparse(matrix) -> bool:
+    """Whether <matrix> is a SciPy sparse matrix. Never imports SciPy, since no sparse matrix exists until it is."""
+    return 'scipy.sparse' in sys.modules and sys.modules['scipy.sparse'].issparse(matrix)
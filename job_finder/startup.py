@@ -0,0 +1,68 @@
+import importlib
+import sys
+import threading
+import time
+
+PROCESS_START = time.perf_counter()
+IMPORT_TIMES = {}  # module name -> seconds spent importing it
+LOAD_TIMES = {}  # model name -> seconds spent loading it
+
+
+def timed_import(name: str):
+    """Import module <name> on first use, recording how long the import took."""
+    if name not in sys.modules:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        IMPORT_TIMES[name] = time.perf_counter() - start
+        return module
+    # import_module waits for a module another thread is still importing; sys.modules would hand it out half done.
+    return importlib.import_module(name)
+
+
+class ModelLoader(object):
+    """Load a Spacy model on a background thread.
+
+    Start it as early as possible; get() blocks only if the model is needed before it has finished loading.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.model = None
+        self.error = None
+        self.waited = 0.  # Seconds callers spent blocked in get().
+        self.thread = threading.Thread(target=self.load, name=f'load-{name}', daemon=True)
+
+    def start(self) -> 'ModelLoader':
+        self.thread.start()
+        return self
+
+    def load(self) -> None:
+        try:
+            spacy = timed_import('spacy')
+            start = time.perf_counter()
+            self.model = spacy.load(self.name)
+            LOAD_TIMES[self.name] = time.perf_counter() - start
+        except Exception as error:  # Re-raised in the thread that asks for the model.
+            self.error = error
+
+    def get(self):
+        """The loaded model, waiting for it if need be."""
+        if self.thread.ident is None:
+            self.start()
+        start = time.perf_counter()
+        self.thread.join()
+        self.waited += time.perf_counter() - start
+        if self.error:
+            raise self.error
+        return self.model
+
+
+def startup_report(loader: ModelLoader = None) -> str:
+    """Summary of import and model load times since the process started."""
+    lines = ['', 'Startup profile:']
+    lines += [f'  import {name:<24} {seconds:8.3f}s' for name, seconds in IMPORT_TIMES.items()]
+    lines += [f'  load {name:<26} {seconds:8.3f}s' for name, seconds in LOAD_TIMES.items()]
+    if loader:
+        lines.append(f'  {"waited on model":<31} {loader.waited:8.3f}s')
+    lines.append(f'  {"total run time":<31} {time.perf_counter() - PROCESS_START:8.3f}s')
+    return '\n'.join(lines)
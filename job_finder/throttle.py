@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import urllib3
+
+from .metrics import metrics
+
+# Statuses meaning the host is overloaded or throttling us; the request is retried later, more slowly.
+THROTTLE_STATUSES = (429, 503)
+
+
+class FetchError(Exception):
+    """A request that could not be completed, after any retries."""
+
+
+class CircuitOpen(FetchError):
+    """A request not attempted because its host has been failing."""
+
+
+class TokenBucket(object):
+    """Rate limit of <rate> requests a second with bursts of up to <burst>, adapting to the host.
+
+    The rate halves each time the host throttles us, down to <min_rate>, and creeps back up towards <max_rate>
+    with each success, so it settles just under what the host tolerates.
+    """
+
+    def __init__(self, rate: float, burst: float = 1., min_rate: float = None) -> None:
+        self.max_rate = self.rate = rate
+        self.min_rate = min_rate or rate / 16
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+
+    def throttled(self, pause: float = 0.) -> None:
+        """Slow down, sending nothing more for <pause> seconds."""
+        with self.lock:
+            self.rate = max(self.rate / 2, self.min_rate)
+            self.tokens = min(self.tokens, 0.)
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def succeeded(self) -> None:
+        with self.lock:
+            self.rate = min(self.rate + self.max_rate / 20, self.max_rate)
+
+
+class CircuitBreaker(object):
+    """Stop sending to a host after <threshold> consecutive failures.
+
+    After <reset_after> seconds one trial request is let through; its success closes the circuit again.
+    """
+
+    def __init__(self, threshold: int = 5, reset_after: float = 30.) -> None:
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def check(self) -> None:
+        """Raise CircuitOpen unless a request may be sent."""
+        with self.lock:
+            if self.opened is None:
+                return
+            if not self.trial and time.monotonic() - self.opened >= self.reset_after:
+                self.trial = True
+                return
+        raise CircuitOpen('Too many recent failures')
+
+    def record(self, success: bool) -> None:
+        with self.lock:
+            if success:
+                self.failures, self.opened, self.trial = 0, None, False
+                return
+            self.failures += 1
+            if self.trial or (self.opened is None and self.failures >= self.threshold):
+                self.opened, self.trial = time.monotonic(), False
+                metrics.count('circuits_opened')
+
+
+def retry_after(response) -> float:
+    """Seconds the response's Retry-After header asks us to wait, or None."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.)
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler(object):
+    """Send requests through <http>, a urllib3 PoolManager, politely.
+
+    Each host gets a TokenBucket starting at <rate> requests a second and a CircuitBreaker. Connection errors,
+    5xx and 429 responses are retried up to <retries> times with jittered exponential backoff from <backoff>
+    seconds, waiting as long as a Retry-After header asks, up to <max_wait> seconds. Share one scheduler between
+    scrapers so their requests to a host are limited together.
+    """
+
+    def __init__(self, http: urllib3.PoolManager, rate: float = 10., burst: float = 10., retries: int = 4,
+                 backoff: float = .5, max_wait: float = 30., failure_threshold: int = 5,
+                 reset_after: float = 30.) -> None:
+        self.http = http
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.hosts = {}  # host -> (TokenBucket, CircuitBreaker)
+        self.lock = threading.Lock()
+
+    def host(self, url: str) -> tuple:
+        host = urlsplit(url).netloc.lower()
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = (TokenBucket(self.rate, self.burst),
+                                    CircuitBreaker(self.failure_threshold, self.reset_after))
+            return self.hosts[host]
+
+    def delay(self, attempt: int) -> float:
+        return min(self.backoff * 2 ** attempt * random.uniform(.5, 1.5), self.max_wait)
+
+    def request(self, method: str, url: str, **kwargs):
+        """The response to a request, retried as needed. Raises FetchError if it never succeeds."""
+        bucket, breaker = self.host(url)
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                metrics.count('fetch_retries')
+            breaker.check()
+            bucket.acquire()
+            try:
+                # Redirects are followed; every other retry is ours.
+                response = self.http.request(method, url,
+                                             retries=urllib3.Retry(total=None, connect=0, read=0, redirect=10),
+                                             **kwargs)
+            except urllib3.exceptions.HTTPError as exception:
+                error = exception
+                breaker.record(False)
+                if attempt < self.retries:
+                    time.sleep(self.delay(attempt))
+                continue
+            if response.status in THROTTLE_STATUSES or response.status >= 500:
+                error = FetchError(f'{response.status} from {url}')
+                breaker.record(False)
+                wait = retry_after(response)
+                if response.status in THROTTLE_STATUSES:
+                    metrics.count('throttled_responses')
+                    bucket.throttled(min(wait or 0., self.max_wait))
+                # No wait after the last attempt; the bucket already holds back this host's other requests.
+                if attempt < self.retries:
+                    time.sleep(min(wait, self.max_wait) if wait is not None else self.delay(attempt))
+                continue
+            breaker.record(True)
+            bucket.succeeded()
+            return response
+        raise FetchError(f'Gave up on {url}: {error}')
@@ -0,0 +1,228 @@
+import fcntl
+import hashlib
+import json
+import numpy as np
+import os
+import time
+
+from contextlib import contextmanager
+
+from tqdm import tqdm
+
+from .metrics import metrics
+from .records import Subset
+
+# Pipeline components that set Doc.tensor, which Doc.vector falls back to when a model ships without word vectors.
+TENSOR_PIPES = ('tok2vec', 'tagger')
+
+
+def unused_pipes(nlp) -> list:
+    """Names of the pipeline components Doc.vector does not depend on."""
+    if nlp.vocab.vectors_length:
+        return list(nlp.pipe_names)
+    return [name for name in nlp.pipe_names if name not in TENSOR_PIPES]
+
+
+def vector_width(nlp) -> int:
+    """Length of the document vectors produced by <nlp>."""
+    if nlp.vocab.vectors_length:
+        return nlp.vocab.vectors_length
+    return len(nlp('width').vector)
+
+
+def vectorize(nlp, texts: list, batch_size: int = 64, n_process: int = 1, progress: bool = True) -> np.ndarray:
+    """Get Spacy document vectors for <texts> as one contiguous float32 matrix.
+
+    Texts are streamed through nlp.pipe in batches of <batch_size>, optionally across <n_process> worker
+    processes, with every component not needed for the vector disabled.
+    """
+    matrix = np.zeros((len(texts), vector_width(nlp)), dtype=np.float32)
+    docs = nlp.pipe(texts, batch_size=batch_size, n_process=n_process, disable=unused_pipes(nlp))
+    for i, doc in enumerate(tqdm(docs, total=len(texts), disable=not progress)):
+        matrix[i] = doc.vector
+    metrics.count('documents_vectorized', len(texts))
+    return matrix
+
+
+def model_name(nlp) -> str:
+    """Name and version of a Spacy model, e.g. en_core_web_sm-2.2.5."""
+    return f"{nlp.meta.get('lang', 'xx')}_{nlp.meta.get('name', 'model')}-{nlp.meta.get('version', '0')}"
+
+
+class StoredRows(object):
+    """Read only view of some <rows> of a memory mapped <matrix>, read from the file only when indexed."""
+
+    def __init__(self, matrix: np.ndarray, rows: list) -> None:
+        self.matrix = matrix
+        self.rows = np.asarray(rows, dtype=np.intp)
+        self.shape = (len(self.rows), matrix.shape[1])
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, rows) -> np.ndarray:
+        return np.asarray(self.matrix[self.rows[rows]], dtype=np.float32)
+
+
+class VectorStore(object):
+    """Content addressed, memory mapped store of document vectors.
+
+    Vectors are keyed by a hash of the model name and document text, so a document is only vectorized the first
+    time it is seen. Rows live in a flat float32 file that is memory mapped for reading and appended to as new
+    documents arrive; a small JSON index maps each key to its row and the time it was last used.
+    Rows unused for <max_age> seconds are dropped, and the data file is compacted once most of it is dead.
+
+    Processes may share a store, like the saved-search service and the command line. Appends and saves hold an
+    exclusive lock on the store and first merge the index other processes have saved; rows are only ever added at
+    the end of the data file, so rows a process has mapped never change under it. Each compaction starts a new
+    generation of row numbers, after which other processes adopt the saved rows and re-embed any of theirs it lost.
+    """
+
+    def __init__(self, directory: str, model: str, max_age: float = 30 * 24 * 60 * 60) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.model = model
+        self.max_age = max_age
+        self.data_path = os.path.join(directory, f'{model}.f32')
+        self.index_path = os.path.join(directory, f'{model}.json')
+        self.lock_path = os.path.join(directory, f'{model}.lock')
+        self.width = None
+        self.size = 0  # Rows in the data file, live or dead.
+        self.rows = {}  # key -> [row, last used]
+        self.generation = 0  # Compactions of the data file, which renumber its rows.
+        with self.locked():
+            self.load()
+
+    def key(self, text: str) -> str:
+        """Content address of <text> under this store's model."""
+        return hashlib.sha1(f'{self.model}\0{text}'.encode('utf-8')).hexdigest()
+
+    @contextmanager
+    def locked(self):
+        """Hold the store's lock, shutting out other processes' appends and saves."""
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load(self) -> None:
+        """Merge in the index last saved by any process, and map every row in the data file. Hold the lock."""
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            rows = index['rows']
+            if index.get('generation', 0) == self.generation:
+                for key, (row, used) in self.rows.items():
+                    rows[key] = [row, max(used, rows[key][1])] if key in rows else [row, used]
+            else:  # Compacted since this process last loaded it: its row numbers are stale.
+                for key, entry in rows.items():
+                    if key in self.rows:
+                        entry[1] = max(entry[1], self.rows[key][1])
+            self.width, self.rows, self.generation = index['width'], rows, index.get('generation', 0)
+        # Rows appended by runs that died before saving belong to no key; they are dropped by the next compaction.
+        row_bytes = (self.width or 0) * 4
+        self.size = os.path.getsize(self.data_path) // row_bytes if row_bytes and os.path.exists(self.data_path) else 0
+        self.matrix = self.map()
+
+    def map(self) -> np.ndarray:
+        """Memory map the data file read only."""
+        if not self.size or not self.width:
+            return np.zeros((self.size, self.width or 0), dtype=np.float32)
+        return np.memmap(self.data_path, dtype=np.float32, mode='r', shape=(self.size, self.width))
+
+    def __contains__(self, text: str) -> bool:
+        return self.key(text) in self.rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def append(self, keys: list, matrix: np.ndarray) -> None:
+        """Add one row of <matrix> per key in <keys>."""
+        with self.locked():
+            self.load()
+            if self.width is None:
+                self.width = matrix.shape[1]
+            now = time.time()
+            with open(self.data_path, 'r+b' if os.path.exists(self.data_path) else 'wb') as f:
+                # Past the last whole row, over any partial row left by a write that died.
+                f.seek(self.size * self.width * 4)
+                f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+                f.truncate()
+            for i, key in enumerate(keys):
+                self.rows[key] = [self.size + i, now]
+            self.size += len(keys)
+            self.matrix = self.map()
+
+    def take(self, rows: list, lazy: bool = False) -> np.ndarray:
+        """Rows of the store as a matrix; a zero copy view when <rows> are consecutive.
+
+        With <lazy>, other rows are a StoredRows view rather than a copy read into memory.
+        """
+        if not rows:
+            return np.zeros((0, self.width or 0), dtype=np.float32)
+        if rows and rows == list(range(rows[0], rows[0] + len(rows))):
+            return self.matrix[rows[0]:rows[0] + len(rows)]
+        if lazy:
+            return StoredRows(self.matrix, rows)
+        return np.asarray(self.matrix[rows], dtype=np.float32)
+
+    def vectors_for(self, texts: list, embed, save: bool = True, lazy: bool = False) -> np.ndarray:
+        """Matrix of vectors for <texts>, a sequence of strings, one row per text.
+
+        Only texts missing from the store are passed to <embed>, which must return one row per text.
+        Pass <save> False when calling repeatedly, then call save() once at the end. Pass <lazy> to get rows that
+        are read from the store only as they are used, as take() does.
+        """
+        keys = [self.key(text) for text in texts]
+        while True:
+            missing = {}  # key -> index of its first text
+            for i, key in enumerate(keys):
+                if key not in self.rows and key not in missing:
+                    missing[key] = i
+            if not missing:
+                break
+            # A view, so texts held out of memory, like spooled descriptions, are read only as they are embedded.
+            # Appending loads other processes' saves; if one compacted the store, rows this call needs may be gone.
+            self.append(list(missing), embed(Subset(texts, list(missing.values()))))
+        now = time.time()
+        rows = []
+        for key in keys:
+            self.rows[key][1] = now
+            rows.append(self.rows[key][0])
+        matrix = self.take(rows, lazy)
+        if save:
+            self.save()
+        return matrix
+
+    def codebook_path(self, mode: str) -> str:
+        """Where the codebook for compressing this store's vectors by quantization <mode> is kept."""
+        return os.path.join(os.path.dirname(self.data_path), f'{self.model}.{mode}.npz')
+
+    def compact(self) -> None:
+        """Rewrite the data file with only live rows, in their current order."""
+        live = sorted(self.rows.items(), key=lambda item: item[1][0])
+        matrix = np.asarray(self.matrix[[row for _, (row, _) in live]], dtype=np.float32)
+        temp_path = self.data_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(matrix.tobytes())
+        os.replace(temp_path, self.data_path)
+        for i, (_, entry) in enumerate(live):
+            entry[0] = i
+        self.size = len(live)
+        self.generation += 1
+        self.matrix = self.map()
+
+    def save(self) -> None:
+        """Drop rows unused for <self.max_age> seconds, compact when most rows are dead, and write the index."""
+        with self.locked():
+            self.load()
+            cutoff = time.time() - self.max_age
+            self.rows = {key: entry for key, entry in self.rows.items() if entry[1] >= cutoff}
+            if self.size > 2 * len(self.rows):
+                self.compact()
+            temp_path = self.index_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({'model': self.model, 'width': self.width, 'size': self.size, 'generation': self.generation,
+                           'rows': self.rows}, f)
+            os.replace(temp_path, self.index_path)
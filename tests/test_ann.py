@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from benchmarks.corpus import clustered_vectors, recall
+from job_finder.ann import STORAGE, IVFIndex
+
+
+def clustered(n: int, queries: int = 0) -> tuple:
+    return clustered_vectors(n, 16, queries, centres=20, spread=.3)
+
+
+def search_recall(index: IVFIndex, queries: np.ndarray, k: int) -> float:
+    """Share of the exact top <k> keys that the probed search finds for the <queries>."""
+    return recall([index.search(query, k)[0][0] for query in queries],
+                  [index.search(query, k, exact=True)[0][0] for query in queries])
+
+
+def test_small_index_searches_exactly(tmp_path):
+    vectors = clustered(50)[0]
+    index = IVFIndex(str(tmp_path / 'index.npz'))
+    index.add([str(i) for i in range(50)], vectors)
+    keys, scores = index.search(vectors[7], 3)
+    assert keys[0][0] == '7'
+    assert scores[0][0] == pytest.approx(1., abs=1e-5)
+
+
+@pytest.mark.parametrize('storage', list(STORAGE))
+def test_search_recalls_exact_search(tmp_path, storage):
+    vectors, queries = clustered(3000, 20)
+    index = IVFIndex(str(tmp_path / 'index.npz'), train_min=1024, storage=storage)
+    for start in range(0, 3000, 500):
+        index.add([str(i) for i in range(start, start + 500)], vectors[start:start + 500])
+    assert index.centroids is not None
+    assert search_recall(index, queries, 10) >= .9
+
+
+def test_remove_and_reload(tmp_path):
+    vectors = clustered(2000)[0]
+    path = str(tmp_path / 'index.npz')
+    index = IVFIndex(path, train_min=256)
+    index.add([str(i) for i in range(2000)], vectors)
+    index.remove([str(i) for i in range(0, 2000, 2)])
+    assert len(index) == 1000
+    index.save()
+    reloaded = IVFIndex(path, train_min=256)
+    assert len(reloaded) == 1000 and '0' not in reloaded and '1' in reloaded
+    keys = reloaded.search(vectors[:5], 10, exact=True)[0]
+    assert all(int(key) % 2 for row in keys for key in row)
+    np.testing.assert_allclose(reloaded.vector('1'), vectors[1] / np.linalg.norm(vectors[1]), atol=1e-6)
+
+
+def test_compacts_when_mostly_removed(tmp_path):
+    index = IVFIndex(str(tmp_path / 'index.npz'), train_min=100)
+    index.add([str(i) for i in range(400)], clustered(400)[0])
+    index.remove([str(i) for i in range(300)])
+    assert index.size == len(index) == 100
+    assert index.search(index.vector('350'), 1, exact=True)[0][0] == ['350']
@@ -0,0 +1,19 @@
+from job_finder.cache import job_key
+
+
+def test_jobkey_links_share_a_key():
+    assert job_key('http://www.indeed.com/rc/clk?jk=abc123&fccid=f1&vjs=3') == 'abc123'
+    assert job_key('https://www.indeed.com/viewjob?vjk=abc123&tk=1e2&from=serp') == 'abc123'
+
+
+def test_sponsored_links_keep_their_ad():
+    first = job_key('http://www.indeed.com/pagead/clk?mo=r&ad=-6NYlbfkN0A&vjs=3&p=1&fvj=0&tk=1e2')
+    second = job_key('http://www.indeed.com/pagead/clk?mo=r&ad=-6NYlbfkN0B&vjs=3&p=1&fvj=0&tk=1e2')
+    assert first != second
+    assert first == job_key('http://WWW.indeed.com//pagead/clk?ad=-6NYlbfkN0A&p=7&mo=r&tk=9f8#apply')
+
+
+def test_company_links_drop_tracking_parameters():
+    url = 'http://www.indeed.com/company/Acme-Corp/jobs/Data-Scientist-0a1b2c3d4e5f6a7b?fccid=f1&vjs=3'
+    assert job_key(url) == 'http://www.indeed.com/company/Acme-Corp/jobs/Data-Scientist-0a1b2c3d4e5f6a7b'
+    assert job_key(url) != job_key('http://www.indeed.com/company/Acme-Corp/jobs/Analyst-9f8e7d6c5b4a3f2e?vjs=3')
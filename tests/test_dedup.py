@@ -0,0 +1,41 @@
+import numpy as np
+
+from job_finder.dedup import greedy_unique
+
+
+def baseline_unique(vectors: np.ndarray, threshold: float, limit: int) -> list:
+    """The original remove_duplicates loop: compare each row to every kept row, one pair at a time."""
+    keep = [0]
+    for i in range(1, len(vectors)):
+        similarities = [vectors[i] @ vectors[j] / np.linalg.norm(vectors[i]) / np.linalg.norm(vectors[j])
+                        for j in keep]
+        if all(similarity < threshold for similarity in similarities):
+            keep.append(i)
+            if len(keep) == limit:
+                break
+    return keep
+
+
+def corpus(n: int, seed: int = 0) -> tuple:
+    """<n> random vectors, about a third of them near copies of earlier rows, and texts copied along with them."""
+    generator = np.random.RandomState(seed)
+    vectors = generator.randn(n, 16)
+    texts = [' '.join(generator.choice(['data', 'python', 'sql', 'model', 'team', 'ship'], 30)) for _ in range(n)]
+    for i in range(1, n):
+        if generator.rand() < .3:
+            source = generator.randint(i)
+            vectors[i] = vectors[source] + 1e-4 * generator.randn(16)
+            texts[i] = texts[source]
+    return vectors, texts
+
+
+def test_matches_baseline_order():
+    vectors, _ = corpus(120)
+    for limit in (5, 40, 120):
+        assert greedy_unique(vectors, threshold=.99, limit=limit) == baseline_unique(vectors, .99, limit)
+
+
+def test_lsh_path_matches_baseline_order():
+    vectors, texts = corpus(400)
+    assert greedy_unique(vectors, threshold=.99, limit=100, texts=texts, lsh_min=256) == \
+        baseline_unique(vectors, .99, 100)
@@ -0,0 +1,35 @@
+import numpy as np
+import scipy.sparse
+
+from job_finder.matching import match_profiles
+
+
+def corpus() -> np.ndarray:
+    """Rows pointing ever further from the first axis, the second row a near copy of the first."""
+    angles = np.array([0., 1e-4, .2, .4, .6, .8, 1., 1.2])
+    return np.stack([np.cos(angles), np.sin(angles), np.zeros(len(angles))], axis=1).astype(np.float32)
+
+
+def test_counts_per_profile():
+    profiles = np.array([[1., 0., 0.], [0., 1., 0.], [1., 1., 0.]], dtype=np.float32)
+    matches = match_profiles(profiles, corpus(), [2, 0, 3], threshold=.99)
+    assert [len(match) for match in matches] == [2, 0, 3]
+    assert matches[2] == [5, 4, 6]
+
+
+def test_one_count_for_every_profile():
+    matches = match_profiles(np.array([1., 0., 0.]), corpus(), 3)
+    assert matches == [[0, 2, 3]]
+
+
+def test_duplicates_dropped_after_top_k():
+    # Row 1 is among the 2 best for the first axis but copies row 0, so the next best takes its place.
+    assert match_profiles(np.array([[1., 0., 0.]]), corpus(), 2, threshold=.99) == [[0, 2]]
+    assert match_profiles(np.array([[1., 0., 0.]]), corpus(), 2, threshold=1.01) == [[0, 1]]
+
+
+def test_sparse_corpus_matches_dense():
+    dense = corpus()
+    profiles = np.array([[1., 0., 0.], [0., 1., 0.]], dtype=np.float32)
+    assert match_profiles(scipy.sparse.csr_matrix(profiles), scipy.sparse.csr_matrix(dense), [3, 2]) == \
+        match_profiles(profiles, dense, [3, 2])
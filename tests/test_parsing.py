@@ -0,0 +1,46 @@
+import pytest
+
+from benchmarks.server import detail_page, results_page
+from job_finder.parsing import BACKENDS, parse_fields, parse_links
+
+PAGES = [
+    detail_page('0000001'),
+    detail_page('0000002'),
+    # A declared encoding, and text outside ASCII.
+    b'<?xml version="1.0" encoding="utf-8"?>' + detail_page('0000003').replace(b'Bench Co', 'Café Co'.encode()),
+    # No title, pay or posted date, and code inside the description.
+    b'<html><body><div id="jobDescriptionText">Own the <b>data</b><script>var x = 1;</script> platform.</div>'
+    b'</body></html>',
+    b'',
+    # Nothing lxml counts as a document.
+    b'<!-- maintenance -->',
+    b'<?xml version="1.0" encoding="utf-8"?>',
+]
+
+
+@pytest.mark.parametrize('page', PAGES)
+def test_backends_extract_the_same_fields(page):
+    expected = parse_fields(page, 'soup')
+    for backend in BACKENDS:
+        assert parse_fields(page, backend) == expected
+    assert parse_fields(page, 'lxml') == parse_fields(page.decode('utf-8'), 'lxml')
+
+
+def test_fields_on_a_fixture_page():
+    fields = parse_fields(PAGES[3], 'lxml')
+    assert fields == {'title': None, 'description': 'Own the data platform.', 'pay': None, 'posted': None}
+    assert parse_fields(PAGES[0], 'lxml')['pay'] == '$50,000 - $70,000 a year'
+
+
+@pytest.mark.parametrize('page', PAGES[-3:])
+def test_empty_results_pages_have_no_links(page):
+    for backend in BACKENDS:
+        assert parse_links(page, backend) == []
+
+
+def test_backends_extract_the_same_links():
+    page = results_page(3, 15)
+    links = parse_links(page, 'soup')
+    assert len(links) == 15
+    for backend in BACKENDS:
+        assert parse_links(page, backend) == links
@@ -0,0 +1,28 @@
+import numpy as np
+
+from job_finder.pipeline import rank_stream
+
+
+def embed(texts) -> np.ndarray:
+    return np.array([[float(text), 1.] for text in texts], dtype=np.float32)
+
+
+def test_query_is_computed_after_the_first_batch():
+    fetched = []
+
+    def listings():
+        for i in range(10):
+            fetched.append(i)
+            yield f'url{i}', str(i), f'title{i}'
+
+    def query() -> np.ndarray:
+        assert len(fetched) == 4  # One batch fetched, as if the model loaded while it was.
+        return np.array([1., 0.])
+
+    rankings = list(rank_stream(listings(), embed, query, k=3, batch_size=4))
+    assert len(rankings) == 3
+    assert [listing[0] for listing, _ in rankings[-1]] == ['url9', 'url8', 'url7']
+
+
+def test_empty_stream_never_computes_the_query():
+    assert list(rank_stream(iter([]), embed, lambda: 1 / 0, k=3)) == []
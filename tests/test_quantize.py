@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from benchmarks.corpus import clustered_vectors, recall
+from job_finder import quantize as quantize_module
+from job_finder.matching import cosine_scores, top_k
+from job_finder.quantize import QUANTIZERS, quantize
+from job_finder.vectors import StoredRows, VectorStore
+
+# Least share of the float32 top 10 that each quantizer must keep.
+RECALL = {'float16': .99, 'int8': .9, 'pq': .7}
+
+
+def embeddings(n: int, width: int = 64, queries: int = 0, seed: int = 0) -> tuple:
+    """Clustered corpus and query vectors, offset so rows are not centred on zero."""
+    vectors, query = clustered_vectors(n, width, queries, seed=seed)
+    return 3 + vectors, 3 + query
+
+
+@pytest.mark.parametrize('mode', sorted(QUANTIZERS))
+def test_top_k_recall(mode):
+    corpus, profiles = embeddings(2000, queries=20)
+    quantized = quantize(corpus, mode)
+    assert quantized.shape == corpus.shape and quantized.nbytes < corpus.nbytes
+    exact = top_k(cosine_scores(profiles, corpus), 10)
+    assert recall(top_k(cosine_scores(profiles, quantized), 10), exact) >= RECALL[mode]
+
+
+@pytest.mark.parametrize('mode', sorted(QUANTIZERS))
+def test_chunked_normalization_matches_whole(mode, monkeypatch):
+    corpus = embeddings(300)[0]
+    whole = quantize(corpus, mode)
+    monkeypatch.setattr(quantize_module, 'CHUNK_ROWS', 64)
+    chunked = quantize(corpus, mode)
+    np.testing.assert_allclose(chunked[:], whole[:], atol=1e-6)
+    np.testing.assert_allclose(chunked.score(corpus[:3]), whole.score(corpus[:3]), rtol=1e-5, atol=1e-5)
+
+
+def test_stored_rows_are_compressed_a_chunk_at_a_time(tmp_path, monkeypatch):
+    corpus = embeddings(300)[0]
+    store = VectorStore(str(tmp_path), 'model')
+    store.vectors_for([str(i) for i in range(300)], lambda texts: corpus[[int(text) for text in texts]])
+    order = [str(i) for i in range(299, -1, -1)]
+    view = store.vectors_for(order, None, lazy=True)
+    assert isinstance(view, StoredRows)
+    monkeypatch.setattr(quantize_module, 'CHUNK_ROWS', 64)
+    np.testing.assert_allclose(quantize(view, 'int8')[:], quantize(corpus[::-1], 'int8')[:], atol=1e-6)
+
+
+def test_codebook_is_saved_and_reused(tmp_path, monkeypatch):
+    monkeypatch.setattr(quantize_module, 'SAMPLE_ROWS', 500)
+    path = str(tmp_path / 'model.pq.npz')
+    first = quantize(embeddings(1000)[0], 'pq', path)
+    assert first.trained_on == 500
+    second = quantize(embeddings(700, seed=2)[0], 'pq', path)
+    assert second.trained_on == 0
+    np.testing.assert_array_equal(second.centroids, first.centroids)
+    assert quantize(embeddings(700, width=32)[0], 'pq', path).trained_on == 500  # Another model's width.
+
+
+def test_small_matrices_stay_float32():
+    corpus = embeddings(10)[0]
+    assert isinstance(quantize(corpus, 'pq'), np.ndarray)
+    assert not isinstance(quantize(corpus, 'float16'), np.ndarray)
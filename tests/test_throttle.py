@@ -0,0 +1,119 @@
+import email.utils
+
+import pytest
+import urllib3
+
+from benchmarks.server import IndeedStandIn
+from job_finder import throttle
+from job_finder.throttle import CircuitBreaker, CircuitOpen, FetchError, RequestScheduler, TokenBucket, retry_after
+
+
+class Clock(object):
+    """Stands in for the time module in throttle: sleeping just moves the clock on."""
+
+    def __init__(self) -> None:
+        self.now = 1000.
+        self.slept = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class Response(object):
+    def __init__(self, **headers) -> None:
+        self.headers = headers
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(throttle, 'time', clock)
+    return clock
+
+
+def test_rate_halves_when_throttled_and_recovers(clock):
+    bucket = TokenBucket(8.)
+    for rate in (4., 2., 1., .5, .5):  # Never below a sixteenth of the starting rate.
+        bucket.throttled()
+        assert bucket.rate == rate
+    for _ in range(19):
+        bucket.succeeded()
+    assert bucket.rate == pytest.approx(8.)
+    bucket.succeeded()
+    assert bucket.rate == 8.
+
+
+def test_throttled_bucket_pauses(clock):
+    bucket = TokenBucket(10., burst=10.)
+    bucket.throttled(pause=5.)
+    start = clock.now
+    bucket.acquire()
+    assert clock.now - start >= 5.
+
+
+def test_bucket_limits_rate(clock):
+    bucket = TokenBucket(4., burst=1.)
+    start = clock.now
+    for _ in range(9):
+        bucket.acquire()
+    assert clock.now - start == pytest.approx(2.)
+
+
+def test_breaker_opens_then_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(threshold=2, reset_after=30.)
+    breaker.record(False)
+    breaker.check()
+    breaker.record(False)
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    clock.now += 30.
+    breaker.check()  # The trial.
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    breaker.record(False)  # The trial failed: open for another <reset_after>.
+    clock.now += 29.
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    clock.now += 1.
+    breaker.check()
+    breaker.record(True)
+    breaker.check()
+    breaker.check()
+
+
+def test_retry_after_seconds_and_dates(clock):
+    assert retry_after(Response()) is None
+    assert retry_after(Response(**{'Retry-After': '120'})) == 120.
+    assert retry_after(Response(**{'Retry-After': '-5'})) == 0.
+    date = email.utils.formatdate(clock.now + 60, usegmt=True)
+    assert retry_after(Response(**{'Retry-After': date})) == pytest.approx(60.)
+    assert retry_after(Response(**{'Retry-After': email.utils.formatdate(clock.now - 60, usegmt=True)})) == 0.
+    assert retry_after(Response(**{'Retry-After': 'soon'})) is None
+
+
+def test_failing_host_is_retried_then_given_up(clock):
+    with IndeedStandIn(error_rate=1.) as stand_in:
+        scheduler = RequestScheduler(urllib3.PoolManager(), retries=3, failure_threshold=10)
+        with pytest.raises(FetchError):
+            scheduler.request('GET', stand_in.url + 'jobs?q=data')
+        assert stand_in.requests == 4
+    assert len(clock.slept) == 3  # Backing off between attempts, not after the last.
+
+
+def test_throttled_host_slows_the_bucket(clock):
+    with IndeedStandIn(rate_limit=1.) as stand_in:
+        stand_in.allowance = -100.  # Out of requests for the next hundred seconds.
+        scheduler = RequestScheduler(urllib3.PoolManager(), rate=8., retries=2)
+        with pytest.raises(FetchError):
+            scheduler.request('GET', stand_in.url + 'jobs?q=data')
+        assert stand_in.throttled == 3
+    bucket, _ = scheduler.host(stand_in.url)
+    assert bucket.rate == 1.
+    assert 1. in clock.slept  # As Retry-After asked.
@@ -0,0 +1,67 @@
+import numpy as np
+import time
+
+from job_finder.vectors import VectorStore
+
+
+def embed(texts) -> np.ndarray:
+    """A vector per text that tells the texts apart."""
+    return np.array([[len(text), 1.] for text in texts], dtype=np.float32)
+
+
+def test_round_trip_and_reopen(tmp_path):
+    store = VectorStore(str(tmp_path), 'model')
+    first = store.vectors_for(['a', 'bb'], embed)
+    np.testing.assert_array_equal(first, embed(['a', 'bb']))
+    reopened = VectorStore(str(tmp_path), 'model')
+    calls = []
+    vectors = reopened.vectors_for(['bb', 'ccc', 'a'], lambda texts: calls.append(list(texts)) or embed(texts))
+    assert calls == [['ccc']]
+    np.testing.assert_array_equal(vectors, embed(['bb', 'ccc', 'a']))
+
+
+def test_rows_appended_without_save_are_skipped(tmp_path):
+    store = VectorStore(str(tmp_path), 'model')
+    store.vectors_for(['a', 'bb'], embed)
+    store.vectors_for(['ccc', 'dddd'], embed, save=False)  # The run dies before saving.
+    reopened = VectorStore(str(tmp_path), 'model')
+    np.testing.assert_array_equal(reopened.vectors_for(['eeeee'], embed), embed(['eeeee']))
+    np.testing.assert_array_equal(VectorStore(str(tmp_path), 'model').vectors_for(['eeeee', 'a'], embed),
+                                  embed(['eeeee', 'a']))
+
+
+def test_compact_keeps_live_rows(tmp_path, monkeypatch):
+    store = VectorStore(str(tmp_path), 'model', max_age=60)
+    store.vectors_for(['a', 'bb', 'ccc', 'dddd'], embed)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 100)  # The others go unused for longer than max_age.
+    store.vectors_for(['bb'], embed)
+    assert store.size == 1
+    np.testing.assert_array_equal(VectorStore(str(tmp_path), 'model').vectors_for(['bb'], embed), embed(['bb']))
+
+
+def test_empty_store_returns_no_rows(tmp_path):
+    assert VectorStore(str(tmp_path), 'model').vectors_for([], embed).shape[0] == 0
+
+
+def test_processes_sharing_a_store(tmp_path):
+    first, second = VectorStore(str(tmp_path), 'model'), VectorStore(str(tmp_path), 'model')
+    first.vectors_for(['a'], embed)
+    np.testing.assert_array_equal(first.vectors_for(['bb'], embed, save=False), embed(['bb']))
+    np.testing.assert_array_equal(second.vectors_for(['cccc'], embed, save=False), embed(['cccc']))
+    first.save()
+    second.save()
+    np.testing.assert_array_equal(VectorStore(str(tmp_path), 'model').vectors_for(['a', 'bb', 'cccc'], embed),
+                                  embed(['a', 'bb', 'cccc']))
+
+
+def test_compaction_by_another_process(tmp_path, monkeypatch):
+    first, second = VectorStore(str(tmp_path), 'model', max_age=60), VectorStore(str(tmp_path), 'model')
+    first.vectors_for(['a', 'bb', 'ccc', 'dddd'], embed)
+    np.testing.assert_array_equal(second.vectors_for(['dddd', 'eeeee'], embed), embed(['dddd', 'eeeee']))
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 100)
+    first.vectors_for(['dddd'], embed)  # Compacts away all but 'dddd', renumbering it.
+    assert first.size == 1
+    np.testing.assert_array_equal(second.vectors_for(['dddd', 'ffffff', 'a'], embed),
+                                  embed(['dddd', 'ffffff', 'a']))